@@ -0,0 +1,138 @@
+"""
+Converts ISO-string date fields to native BSON dates in throttled batches.
+
+    python migrate_dates.py [--batch-size 500] [--pause-ms 200] [--only tasks,bills]
+
+Progress (last _id and converted count per collection) is kept in the
+`migrations` collection, so the script can be stopped and re-run at any
+time while the API keeps serving. Each update is conditional on the field
+still holding the string that was read, so concurrent writes win.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MIGRATION_ID = "native_dates_v1"
+
+DATE_FIELDS = {
+    "users": ["created_at"],
+    "onboarding_profiles": ["completed_at"],
+    "tasks": ["created_at", "completed_at"],
+    "tasks_archive": ["created_at", "completed_at"],
+    "routines": ["created_at"],
+    "bills": ["created_at", "due_date"],
+    "energy_checkins": ["created_at"],
+    "chat_messages": ["created_at"],
+    "chat_messages_archive": ["created_at"],
+    "chat_sessions_archive": ["first_message_at", "last_message_at"],
+    "weekly_resets": ["created_at"],
+    "morning_checkins": ["created_at", "date"],
+}
+
+logger = logging.getLogger("migrate_dates")
+
+
+def to_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+async def migrate_collection(db, name: str, fields: list, batch_size: int, pause: float) -> int:
+    progress = await db.migrations.find_one({"_id": MIGRATION_ID}) or {}
+    state = progress.get("collections", {}).get(name, {})
+    last_id = state.get("last_id")
+    converted = state.get("converted", 0)
+
+    while True:
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = await db[name].find(query, {field: 1 for field in fields}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        operations = []
+        for doc in docs:
+            changes = {}
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    changes[field] = to_datetime(value)
+                except ValueError:
+                    logger.warning(f"{name} {doc['_id']}: leaving unparseable {field} {value!r}")
+            if changes:
+                operations.append(UpdateOne(
+                    {"_id": doc['_id'], **{field: doc[field] for field in changes}},
+                    {"$set": changes}
+                ))
+        if operations:
+            result = await db[name].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+
+        last_id = docs[-1]['_id']
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {
+                f"collections.{name}": {
+                    "last_id": last_id,
+                    "converted": converted,
+                    "updated_at": datetime.now(timezone.utc),
+                }
+            }},
+            upsert=True
+        )
+        logger.info(f"{name}: {converted} documents converted")
+        await asyncio.sleep(pause)
+
+    return converted
+
+
+async def main(batch_size: int, pause_ms: int, only: list):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$setOnInsert": {"started_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        for name, fields in DATE_FIELDS.items():
+            if only and name not in only:
+                continue
+            converted = await migrate_collection(db, name, fields, batch_size, pause_ms / 1000)
+            logger.info(f"{name}: done ({converted} converted)")
+        if not only:
+            await db.migrations.update_one(
+                {"_id": MIGRATION_ID},
+                {"$set": {"completed_at": datetime.now(timezone.utc)}}
+            )
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause-ms", type=int, default=200, help="sleep between batches to limit load")
+    parser.add_argument("--only", default="", help="comma-separated collections to migrate")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(main(args.batch_size, args.pause_ms, [c for c in args.only.split(",") if c]))
@@ -0,0 +1,64 @@
+"""
+Prints where backend cold-start time goes, using CPython's -X importtime.
+
+    python profile_startup.py [--top 25] [--with-llm]
+
+Imports `server` in a fresh interpreter and reports the slowest top-level
+packages (by self time) and the slowest individual imports (by cumulative
+time). --with-llm also loads the lazily imported LLM integration.
+"""
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+
+
+def profile_imports(with_llm: bool):
+    code = "import server"
+    if with_llm:
+        code += "; server.import_llm_module()"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main(top: int, with_llm: bool):
+    imports = profile_imports(with_llm)
+    by_package = defaultdict(int)
+    for name, self_us, _ in imports:
+        by_package[name.split(".")[0]] += self_us
+
+    total_ms = sum(by_package.values()) / 1000
+    print(f"Total import time: {total_ms:.0f} ms across {len(imports)} modules\n")
+
+    print(f"{'package':<40} {'self ms':>10} {'share':>7}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{package:<40} {self_us / 1000:>10.1f} {self_us / 1000 / total_ms:>7.1%}")
+
+    print(f"\n{'module':<60} {'cumulative ms':>14}")
+    for name, _, cumulative_us in sorted(imports, key=lambda item: item[2], reverse=True)[:top]:
+        print(f"{name:<60} {cumulative_us / 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--with-llm", action="store_true", help="include the lazily loaded LLM integration")
+    args = parser.parse_args()
+    main(args.top, args.with_llm)
@@ -1,24 +1,710 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import csv
+import gzip
+import json
+import zlib
+import hashlib
+import hmac
+import random
+import sys
+import time
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, validator
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter, ValidationError, create_model, validator
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
+from bson import Binary
+from bson.timestamp import Timestamp
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict, defaultdict, deque
+from contextlib import AsyncExitStack, asynccontextmanager
 import uuid
-from datetime import datetime, timezone
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from datetime import datetime, timezone, timedelta
+import numpy as np
+import importlib
+import threading
+import weakref
+import pymongo
+from contextvars import Context, ContextVar
+
+try:
+    import zstandard
+except ImportError:  # archive compression is optional
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are optional
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # brotli responses are optional; gzip is always available
+    brotli = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Tracks per-server connection pool occupancy from PyMongo's CMAP events.
+    Events arrive on driver threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._servers = defaultdict(lambda: {
+            "open": 0,
+            "checked_out": 0,
+            "waiting": 0,
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "cleared": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        })
+
+    def _update(self, event, **deltas):
+        server = f"{event.address[0]}:{event.address[1]}"
+        with self._lock:
+            stats = self._servers[server]
+            for key, delta in deltas.items():
+                stats[key] += delta
+
+    def pool_created(self, event):
+        self._update(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        # Check-out start and finish are reported on the same thread
+        self._local.started = time.perf_counter()
+        self._update(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event, waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        waited_ms = (time.perf_counter() - getattr(self._local, "started", time.perf_counter())) * 1000
+        self._update(event, waiting=-1, checked_out=1, checkouts=1, total_wait_ms=waited_ms)
+        server = f"{event.address[0]}:{event.address[1]}"
+        with self._lock:
+            stats = self._servers[server]
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], waited_ms)
+
+    def connection_checked_in(self, event):
+        self._update(event, checked_out=-1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                server: {
+                    **stats,
+                    "avg_wait_ms": stats["total_wait_ms"] / stats["checkouts"] if stats["checkouts"] else 0.0,
+                }
+                for server, stats in self._servers.items()
+            }
+
+# Per-request timings
+# A request being profiled (see Request profiling) carries its RequestProfile in
+# active_profile. Motor copies the context into its executor threads, so
+# command events fired there can be attributed to the request that issued them.
+active_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("active_profile", default=None)
+
+def record_timing(kind: str, **details):
+    profile = active_profile.get()
+    if profile is not None:
+        profile.add_timing(kind, details)
+
+class ProfileCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[tuple, Tuple["RequestProfile", str, Optional[str]]] = {}
+
+    @staticmethod
+    def _key(event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        profile = active_profile.get()
+        if profile is None:
+            return
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._started[self._key(event)] = (
+                profile, event.command_name, collection if isinstance(collection, str) else None
+            )
+
+    def _finish(self, event, ok: bool):
+        with self._lock:
+            entry = self._started.pop(self._key(event), None)
+        if entry is not None:
+            profile, command, collection = entry
+            profile.add_timing("mongo", {
+                "command": command,
+                "collection": collection,
+                "duration_ms": event.duration_micros / 1000,
+                "ok": ok,
+            })
+
+    def succeeded(self, event):
+        self._finish(event, ok=True)
+
+    def failed(self, event):
+        self._finish(event, ok=False)
+
+# Slow command log
+# Commands slower than SLOW_COMMAND_MS are queued by the listener (on driver
+# threads) and written to the capped slow_commands collection by
+# run_slow_command_writer, with filters reduced to their shape: field names
+# and operators kept, values replaced by "?". With SLOW_COMMAND_EXPLAIN on,
+# reads also get an executionStats summary, at most once per shape per
+# SLOW_COMMAND_EXPLAIN_INTERVAL_SECONDS.
+SLOW_COMMAND_MS = float(os.environ.get('SLOW_COMMAND_MS', '100'))
+SLOW_COMMAND_EXPLAIN = os.environ.get('SLOW_COMMAND_EXPLAIN', 'false').lower() == 'true'
+SLOW_COMMAND_EXPLAIN_INTERVAL_SECONDS = int(os.environ.get('SLOW_COMMAND_EXPLAIN_INTERVAL_SECONDS', '600'))
+SLOW_COMMAND_LOG_BYTES = int(os.environ.get('SLOW_COMMAND_LOG_BYTES', str(64 * 1024 * 1024)))
+SLOW_COMMAND_COLLECTION = "slow_commands"
+_UNLOGGED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions",
+    "saslStart", "saslContinue", "authenticate", "killCursors", "explain",
+}
+_EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+
+def query_shape(value):
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Operator arrays ($and/$or clauses, pipelines) keep their structure;
+        # lists of plain values ($in, $all) collapse like any other literal
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return "?"
+    return "?"
+
+def command_shape(name: str, command: dict) -> dict:
+    if name == "find":
+        shape = {"filter": command.get("filter", {}), "sort": command.get("sort"), "projection": command.get("projection")}
+    elif name == "aggregate":
+        shape = {"pipeline": command.get("pipeline", [])}
+    elif name in ("count", "distinct", "findAndModify"):
+        shape = {"query": command.get("query", {}), "sort": command.get("sort")}
+        if name == "distinct":
+            shape["key"] = command.get("key")
+    elif name in ("update", "delete"):
+        statements = command.get("updates" if name == "update" else "deletes") or [{}]
+        shape = {"q": statements[0].get("q", {})}
+    else:
+        return {}
+    shape = {key: value for key, value in shape.items() if value is not None}
+    # Field names in sort/projection/distinct key are structure, not literals
+    return {key: value if key in ("sort", "projection", "key") else query_shape(value) for key, value in shape.items()}
+
+class SlowCommandListener(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float):
+        self.threshold_ms = threshold_ms
+        self.pending: deque = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._started: Dict[tuple, dict] = {}
+
+    def started(self, event):
+        if event.command_name in _UNLOGGED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if collection == SLOW_COMMAND_COLLECTION:
+            return
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = {
+                "database": event.database_name,
+                "collection": collection if isinstance(collection, str) else None,
+                "command": event.command,
+            }
+
+    def _finish(self, event, ok: bool, reply: Optional[dict] = None):
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if started is None or duration_ms < self.threshold_ms:
+            return
+        command = started.pop("command")
+        shape = command_shape(event.command_name, command)
+        entry = {
+            "at": datetime.now(timezone.utc),
+            "duration_ms": duration_ms,
+            "command": event.command_name,
+            **started,
+            "shape": shape,
+            "shape_key": json.dumps(shape, sort_keys=True, default=str),
+            "ok": ok,
+        }
+        if reply:
+            batch = reply.get("cursor", {}).get("firstBatch")
+            entry["returned"] = len(batch) if batch is not None else reply.get("n")
+        if SLOW_COMMAND_EXPLAIN and ok and event.command_name in _EXPLAINABLE_COMMANDS:
+            entry["_explain_command"] = command
+        self.pending.append(entry)
+
+    def succeeded(self, event):
+        self._finish(event, ok=True, reply=event.reply)
+
+    def failed(self, event):
+        self._finish(event, ok=False)
+
+# Tracing
+# With TRACING_ENABLED, each sampled request gets a server span (see
+# trace_request) with client spans under it for every Mongo command and LLM
+# call. Spans are written in the OTLP/JSON file format, one batch per line, to
+# stdout or TRACE_FILE, so an OpenTelemetry collector (otlpjsonfile receiver)
+# or any JSON tooling can read them. Incoming W3C traceparent headers are
+# continued, and log records carry the trace id.
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'console')
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+TRACE_FLUSH_SECONDS = float(os.environ.get('TRACE_FLUSH_SECONDS', '1'))
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'mindattic-server')
+TRACEPARENT_HEADER = "traceparent"
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: Optional[str] = None, attributes: Optional[dict] = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self, end_ns: Optional[int] = None):
+        span_exporter.export(self, end_ns or time.time_ns())
+
+def start_span(name: str, kind: int, attributes: Optional[dict] = None) -> Optional[Span]:
+    """
+    Starts a child of the current span, or returns None outside a sampled trace.
+    """
+    parent = current_span.get()
+    if parent is None:
+        return None
+    return Span(name, kind, parent.trace_id, parent.span_id, attributes)
+
+def otlp_attributes(attributes: dict) -> list:
+    encoded = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            encoded.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            encoded.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            encoded.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            encoded.append({"key": key, "value": {"stringValue": str(value)}})
+    return encoded
+
+class SpanExporter:
+    """
+    Buffers finished spans (from the event loop and driver threads alike) and
+    writes them from a background thread every TRACE_FLUSH_SECONDS.
+    """
+    def __init__(self, exporter: str, path: str):
+        self.exporter = exporter
+        self.path = path
+        self.pending: deque = deque(maxlen=100000)
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self, span: Span, end_ns: int):
+        self.pending.append((span, end_ns))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._wake.clear()
+
+    def _run(self):
+        while not self._wake.wait(TRACE_FLUSH_SECONDS):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        spans = []
+        while self.pending:
+            span, end_ns = self.pending.popleft()
+            spans.append({
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": span.kind,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(end_ns),
+                "attributes": otlp_attributes(span.attributes),
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            })
+        if not spans:
+            return
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": TRACE_SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "server"}, "spans": spans}],
+        }]}, default=str)
+        try:
+            if self.exporter == "file":
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+            else:
+                sys.stdout.write(line + "\n")
+                sys.stdout.flush()
+        except OSError as e:
+            logging.error(f"Span export error: {str(e)}")
+
+span_exporter = SpanExporter(TRACE_EXPORTER, TRACE_FILE)
+
+class TraceCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[tuple, Span] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else None
+        span = start_span(
+            f"{event.command_name} {collection}" if collection else event.command_name,
+            SPAN_KIND_CLIENT,
+            {
+                "db.system": "mongodb",
+                "db.namespace": event.database_name,
+                "db.operation.name": event.command_name,
+                "db.collection.name": collection,
+                "server.address": event.connection_id[0],
+                "server.port": event.connection_id[1],
+            },
+        )
+        if span is None:
+            return
+        shape = command_shape(event.command_name, event.command)
+        if shape:
+            span.attributes["db.query.text"] = json.dumps(shape, default=str)
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = span
+
+    def _finish(self, event, error: Optional[str] = None):
+        with self._lock:
+            span = self._started.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.error = error
+            span.end(span.start_ns + event.duration_micros * 1000)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, error=str(event.failure.get("errmsg", "command failed")))
+
+def estimate_tokens(text: Optional[str]) -> int:
+    # Roughly four characters per token for English text; the integration
+    # doesn't report usage, so these are estimates
+    return (len(text) + 3) // 4 if text else 0
+
+def start_llm_span(call: str, provider: Optional[str], model: Optional[str], prompt: str) -> Optional[Span]:
+    return start_span(f"{call} {model}" if model else call, SPAN_KIND_CLIENT, {
+        "gen_ai.operation.name": "chat",
+        "gen_ai.system": provider,
+        "gen_ai.request.model": model,
+        "gen_ai.usage.input_tokens": estimate_tokens(prompt),
+        "gen_ai.usage.estimated": True,
+    })
+
+def end_llm_span(span: Optional[Span], reply: Optional[str], error: Optional[Exception] = None):
+    if span is None:
+        return
+    span.attributes["gen_ai.usage.output_tokens"] = estimate_tokens(reply)
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    span.end()
+
+_base_log_record_factory = logging.getLogRecordFactory()
+
+def trace_log_record_factory(*args, **kwargs):
+    # Set on every record, so any handler's format can use %(trace_id)s,
+    # including handlers added after startup (uvicorn's, test harnesses')
+    record = _base_log_record_factory(*args, **kwargs)
+    span = current_span.get()
+    record.trace_id = span.trace_id if span else "-"
+    record.span_id = span.span_id if span else "-"
+    return record
+
+# Pool settings left unset keep the driver defaults
+MONGO_POOL_OPTIONS = {
+    option: int(os.environ[env])
+    for env, option in [
+        ('MONGO_MAX_POOL_SIZE', 'maxPoolSize'),
+        ('MONGO_MIN_POOL_SIZE', 'minPoolSize'),
+        ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS'),
+        ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS'),
+        ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS'),
+    ]
+    if os.environ.get(env)
+}
+MONGO_READY_TIMEOUT_MS = int(os.environ.get('MONGO_READY_TIMEOUT_MS', '2000'))
+
+pool_stats = PoolStatsListener()
+profile_commands = ProfileCommandListener()
+slow_commands = SlowCommandListener(SLOW_COMMAND_MS)
+command_listeners = [pool_stats, profile_commands, slow_commands]
+if TRACING_ENABLED:
+    command_listeners.append(TraceCommandListener())
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    event_listeners=command_listeners,
+    **MONGO_POOL_OPTIONS
+)
 db = client[os.environ['DB_NAME']]
 
+# Reads that tolerate bounded staleness go through read_db, which prefers
+# secondaries (on a standalone server it simply uses the primary). Routes that
+# must see their own writes pair it with a causally consistent session; the
+# session's operation time is handed to the client as X-Causal-Token so a
+# follow-up read can wait for the same point.
+MONGO_READ_FROM_SECONDARIES = os.environ.get('MONGO_READ_FROM_SECONDARIES', 'true').lower() == 'true'
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90'))  # driver minimum is 90
+if MONGO_READ_FROM_SECONDARIES:
+    read_db = client.get_database(
+        os.environ['DB_NAME'],
+        read_preference=SecondaryPreferred(max_staleness=MONGO_MAX_STALENESS_SECONDS)
+    )
+else:
+    read_db = db
+CAUSAL_TOKEN_HEADER = "X-Causal-Token"
+
+async def causal_session(token: Optional[str] = None):
+    session = await client.start_session(causal_consistency=True)
+    if token:
+        try:
+            seconds, increment = (int(part) for part in token.split(".", 1))
+            session.advance_operation_time(Timestamp(seconds, increment))
+        except ValueError:
+            pass
+    return session
+
+def set_causal_token(response: Response, session):
+    if session.operation_time is not None:
+        response.headers[CAUSAL_TOKEN_HEADER] = f"{session.operation_time.time}.{session.operation_time.inc}"
+
+# LLM integration
+# emergentintegrations pulls in a large dependency tree (litellm, google-genai,
+# boto3, ...), so it is imported on first use or warmed in the background
+# after startup instead of at module load.
+LLM_WARMUP = os.environ.get('LLM_WARMUP', 'true').lower() == 'true'
+LLM_WARMUP_DELAY_SECONDS = float(os.environ.get('LLM_WARMUP_DELAY_SECONDS', '1'))
+_llm_module = None
+_llm_module_lock = threading.Lock()
+
+def import_llm_module():
+    global _llm_module
+    with _llm_module_lock:
+        if _llm_module is None:
+            started = time.perf_counter()
+            _llm_module = importlib.import_module("emergentintegrations.llm.chat")
+            logging.info(f"Loaded LLM integration in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return _llm_module
+
+async def load_llm_module():
+    if _llm_module is not None:
+        return _llm_module
+    # Import off the event loop so CRUD requests keep flowing meanwhile
+    return await asyncio.get_running_loop().run_in_executor(None, import_llm_module)
+
+# LlmChat only has a buffered send_message, so streamed replies call litellm
+# (which the integration is built on) directly. That needs a provider key in
+# LLM_STREAM_API_KEY, and LLM_STREAM_API_BASE when it goes through a proxy;
+# without a key, streamed routes get the buffered reply in one chunk.
+LLM_STREAM_API_KEY = os.environ.get('LLM_STREAM_API_KEY')
+LLM_STREAM_API_BASE = os.environ.get('LLM_STREAM_API_BASE')
+_litellm_module = None
+
+def import_litellm_module():
+    global _litellm_module
+    with _llm_module_lock:
+        if _litellm_module is None:
+            _litellm_module = importlib.import_module("litellm")
+    return _litellm_module
+
+async def load_litellm_module():
+    if _litellm_module is not None:
+        return _litellm_module
+    return await asyncio.get_running_loop().run_in_executor(None, import_litellm_module)
+
+# Request deadlines
+# Every request gets a deadline from its route class (see route_lane), which a
+# client may override with X-Request-Timeout-Ms. Mongo operations inherit it
+# through pymongo.timeout (sent as maxTimeMS), LLM calls through wait_for.
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+DEADLINES_MS = {
+    "llm": int(os.environ.get('DEADLINE_LLM_MS', '60000')),
+    "crud": int(os.environ.get('DEADLINE_CRUD_MS', '10000')),
+}
+DEADLINE_MAX_MS = int(os.environ.get('DEADLINE_MAX_MS', '120000'))
+# Streaming bulk routes only get a deadline when the client asks for one
+UNBOUNDED_ROUTE_PREFIXES = ("/api/export/", "/api/import/")
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    pass
+
+def remaining_seconds() -> Optional[float]:
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def is_deadline_error(e: Exception) -> bool:
+    return isinstance(e, DeadlineExceeded) or (isinstance(e, PyMongoError) and e.timeout)
+
+async def send_llm_message(chat_client, message) -> str:
+    remaining = remaining_seconds()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Request deadline passed before the LLM call")
+    started = time.perf_counter()
+    span = start_llm_span(
+        "send_message",
+        getattr(chat_client, "provider", None),
+        getattr(chat_client, "model", None),
+        (getattr(chat_client, "system_message", None) or "") + (getattr(message, "text", None) or ""),
+    )
+    reply = None
+    error = None
+    try:
+        reply = await asyncio.wait_for(chat_client.send_message(message), timeout=remaining)
+        return reply
+    except asyncio.TimeoutError:
+        error = DeadlineExceeded("LLM call exceeded the request deadline")
+        raise error
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        record_timing("llm", call="send_message", duration_ms=(time.perf_counter() - started) * 1000, ok=error is None)
+        end_llm_span(span, reply, error)
+
+async def stream_llm_message(chat_client, message, system_message: str, provider: str, model: str):
+    """
+    Yields the reply in chunks as the provider produces them, through litellm
+    when LLM_STREAM_API_KEY is set. Otherwise chat_client's buffered reply
+    arrives as one chunk.
+    """
+    if not LLM_STREAM_API_KEY:
+        yield await send_llm_message(chat_client, message)
+        return
+    litellm = await load_litellm_module()
+    started = time.perf_counter()
+    span = start_llm_span("stream_message", provider, model, system_message + message.text)
+    first_chunk_ms = None
+    received = []
+    ok = False
+    error = None
+    try:
+        remaining = remaining_seconds()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("Request deadline passed before the LLM call")
+        try:
+            response = await asyncio.wait_for(litellm.acompletion(
+                model=f"{provider}/{model}",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": message.text},
+                ],
+                stream=True,
+                api_key=LLM_STREAM_API_KEY,
+                api_base=LLM_STREAM_API_BASE,
+            ), timeout=remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("LLM call exceeded the request deadline")
+        chunks = response.__aiter__()
+        while True:
+            remaining = remaining_seconds()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded("LLM stream exceeded the request deadline")
+            try:
+                chunk = await asyncio.wait_for(anext(chunks), timeout=remaining)
+            except StopAsyncIteration:
+                ok = True
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("LLM stream exceeded the request deadline")
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if not text:
+                continue
+            if first_chunk_ms is None:
+                first_chunk_ms = (time.perf_counter() - started) * 1000
+            received.append(text)
+            yield text
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        record_timing(
+            "llm",
+            call="stream_message",
+            duration_ms=(time.perf_counter() - started) * 1000,
+            first_chunk_ms=first_chunk_ms,
+            ok=ok,
+        )
+        if span is not None and first_chunk_ms is not None:
+            span.attributes["gen_ai.response.first_chunk_ms"] = first_chunk_ms
+        if error is None and not ok:
+            error = Exception("stream closed before completion")
+        end_llm_span(span, "".join(received), error)
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -101,6 +787,36 @@ TONE
 
 BOUNDARY: Chat never organizes. Chat never creates tasks. Chat is for being witnessed."""
 
+# Brain Offload sorting prompt
+BRAIN_OFFLOAD_PROMPT = """You are The Attic Mind's gentle organizing assistant. A user has shared their thoughts, worries, and to-dos in a stream-of-consciousness way. Your job is to:
+
+1. Extract actionable tasks from their text
+2. Sort each task into one of three categories:
+   - "today" - things that feel urgent or time-sensitive for today
+   - "this_week" - things that matter this week but don't need immediate attention
+   - "later" - things to remember but can wait
+
+3. Keep task titles SHORT (3-8 words), clear, and gentle
+4. Don't add tasks that aren't in the original text
+5. If something is vague, interpret it kindly
+
+Return ONLY a JSON array in this exact format:
+[
+  {"title": "Task description", "category": "today"},
+  {"title": "Another task", "category": "this_week"},
+  {"title": "Future item", "category": "later"}
+]
+
+Do not include any other text, explanations, or markdown - just the JSON array."""
+
+# Used when several users' offloads are sorted in one request
+BRAIN_OFFLOAD_BATCH_PROMPT = BRAIN_OFFLOAD_PROMPT + """
+
+BATCH MODE: You will receive several unrelated brain dumps, each wrapped between <<<DOC n>>> and <<<END DOC n>>>. Sort every document separately using the rules above and never move tasks from one document to another.
+
+Instead of a single array, return ONLY a JSON object that maps each document number to its JSON array, for example:
+{"1": [{"title": "Task description", "category": "today"}], "2": []}"""
+
 # Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -143,6 +859,7 @@ class Task(BaseModel):
     description: Optional[str] = None
     category: str = "today"  # today, this_week, later
     completed: bool = False
+    completed_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class TaskCreate(BaseModel):
@@ -233,6 +950,15 @@ class EnergyCheckInCreate(BaseModel):
     energy_level: int
     notes: Optional[str] = None
 
+class EnergyTrendPoint(BaseModel):
+    created_at: datetime
+    energy_level: float
+
+class EnergyTrendResponse(BaseModel):
+    points: List[EnergyTrendPoint]
+    total_checkins: int
+    downsampled: bool
+
 class ChatMessage(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -258,6 +984,8 @@ class BrainOffloadRequest(BaseModel):
 class SortedTask(BaseModel):
     title: str
     category: str  # today, this_week, later
+    duplicate_of: Optional[str] = None  # id of a likely-duplicate open task
+    duplicate_title: Optional[str] = None
 
 class BrainOffloadResponse(BaseModel):
     tasks: List[SortedTask]
@@ -292,6 +1020,603 @@ class WeeklyResetCreate(BaseModel):
     feeling: Optional[str] = None
     anchors: List[str] = []
 
+class SearchResult(BaseModel):
+    source: str  # chat_messages, tasks, weekly_resets
+    id: str
+    text: str
+    score: float
+    session_id: Optional[str] = None
+    created_at: datetime
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
+    offset: int
+    limit: int
+    has_more: bool
+
+class ImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+class ImportReport(BaseModel):
+    rows: int
+    imported: Dict[str, int]
+    errors: List[ImportRowError]
+    errors_truncated: bool = False
+
+class BatchOperation(BaseModel):
+    op: str = Field(..., pattern="^(create|update|delete)$")
+    collection: str = Field(..., pattern="^(tasks|bills|routines)$")
+    id: Optional[str] = None
+    data: Dict = Field(default_factory=dict)
+
+class BatchRequest(BaseModel):
+    user_id: str
+    operations: List[BatchOperation] = Field(..., min_length=1, max_length=500)
+
+class BatchOperationResult(BaseModel):
+    index: int
+    ok: bool = False
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchOperationResult]
+
+def task_update_fields(update: TaskUpdate) -> dict:
+    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
+    # completed_at drives archival of old completed tasks
+    if update.completed is True:
+        update_data['completed_at'] = datetime.now(timezone.utc)
+    elif update.completed is False:
+        update_data['completed_at'] = None
+    return update_data
+
+def to_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+# Dates are stored as native BSON dates. Documents written before
+# migrate_dates.py has run may still hold ISO strings, so reads accept both.
+def parse_calendar_date(value: str):
+    try:
+        return to_utc(datetime.fromisoformat(value))
+    except ValueError:
+        return value
+
+def format_calendar_date(value) -> str:
+    if isinstance(value, datetime):
+        if (value.hour, value.minute, value.second, value.microsecond) == (0, 0, 0, 0):
+            return value.date().isoformat()
+        return value.isoformat()
+    return value
+
+def date_condition(field: str, bounds: dict) -> dict:
+    """Matches datetime bounds against both native dates and legacy ISO strings."""
+    return {"$or": [
+        {field: bounds},
+        {field: {op: to_utc(bound).isoformat() for op, bound in bounds.items()}},
+    ]}
+
+async def find_chronological(
+    collection, query: dict, projection: Optional[dict], field: str, direction: int, limit: Optional[int]
+) -> List[dict]:
+    """
+    Sorted read on a date field that may still hold legacy ISO strings. Mongo
+    orders every string before every date, so each type is read with its own
+    sort and the two are merged by time; `field` comes back as a datetime.
+    """
+    docs = []
+    for bson_type in ("date", "string"):
+        docs += await collection.find(
+            {"$and": [query, {field: {"$type": bson_type}}]}, projection
+        ).sort(field, direction).to_list(limit)
+    for doc in docs:
+        value = doc[field]
+        doc[field] = to_utc(datetime.fromisoformat(value) if isinstance(value, str) else value)
+    docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+    return docs[:limit] if limit is not None else docs
+
+# Task duplicate detection
+# Open task titles are reduced to MinHash signatures and bucketed with LSH
+# banding, so a lookup only compares against tasks that share a band rather
+# than the user's whole backlog.
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+MINHASH_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+_MINHASH_PRIME = np.uint64((1 << 31) - 1)
+_minhash_rng = np.random.default_rng(2024)
+_MINHASH_A = _minhash_rng.integers(1, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+TITLE_STOPWORDS = {"a", "an", "the", "to", "my", "for", "of", "and", "on", "at", "in", "with", "up", "some"}
+
+def title_shingles(title: str) -> set:
+    words = re.findall(r"[a-z0-9']+", title.lower())
+    words = [w for w in words if w not in TITLE_STOPWORDS] or words
+    text = " ".join(words)
+    if len(text) < 3:
+        return {text}
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def minhash_signature(shingles: set) -> np.ndarray:
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    return ((np.outer(_MINHASH_A, hashes) + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+class _UserTaskIndex:
+    def __init__(self):
+        self.signatures: Dict[str, Tuple[np.ndarray, str]] = {}
+        self.buckets: Dict[Tuple[int, bytes], set] = defaultdict(set)
+
+    @staticmethod
+    def band_keys(signature: np.ndarray):
+        for band in range(MINHASH_BANDS):
+            yield band, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].tobytes()
+
+    def add(self, task_id: str, title: str):
+        self.remove(task_id)
+        signature = minhash_signature(title_shingles(title))
+        self.signatures[task_id] = (signature, title)
+        for key in self.band_keys(signature):
+            self.buckets[key].add(task_id)
+
+    def remove(self, task_id: str):
+        entry = self.signatures.pop(task_id, None)
+        if entry is None:
+            return
+        for key in self.band_keys(entry[0]):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(task_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def best_match(self, title: str, threshold: float) -> Optional[Tuple[str, str, float]]:
+        signature = minhash_signature(title_shingles(title))
+        candidates = set()
+        for key in self.band_keys(signature):
+            candidates |= self.buckets.get(key, set())
+        best = None
+        for task_id in candidates:
+            other, other_title = self.signatures[task_id]
+            similarity = float(np.mean(signature == other))
+            if similarity >= threshold and (best is None or similarity > best[2]):
+                best = (task_id, other_title, similarity)
+        return best
+
+class TaskDuplicateIndex:
+    """
+    In-process, per-user index of open task titles. Users are loaded lazily on
+    first lookup and evicted LRU. The task routes keep loaded users in sync
+    with this worker's writes; writes made by other workers arrive through the
+    change stream (see ChangeHub._apply). Without change streams (standalone
+    Mongo), each worker only sees its own writes until the user is evicted
+    and reloaded.
+    """
+
+    def __init__(self, max_users: int, threshold: float):
+        self.max_users = max_users
+        self.threshold = threshold
+        self._users: "OrderedDict[str, _UserTaskIndex]" = OrderedDict()
+        self._owners: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Changes seen while a user's tasks are being read, replayed afterwards
+        self._loading: Dict[str, list] = {}
+
+    async def _get(self, user_id: str) -> _UserTaskIndex:
+        if user_id in self._users:
+            self._users.move_to_end(user_id)
+            return self._users[user_id]
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if user_id not in self._users:
+                index = _UserTaskIndex()
+                changes = self._loading[user_id] = []
+                try:
+                    cursor = db.tasks.find(
+                        {"user_id": user_id, "completed": {"$ne": True}},
+                        {"_id": 0, "id": 1, "title": 1}
+                    )
+                    async for task in cursor:
+                        index.add(task['id'], task['title'])
+                        self._owners[task['id']] = user_id
+                finally:
+                    del self._loading[user_id]
+                # A write during the scan may be missing from the cursor, or
+                # read before it changed; the routes' own view wins
+                self._users[user_id] = index
+                for change in changes:
+                    if change[0] == "sync":
+                        self.sync(change[1])
+                    else:
+                        self.remove(change[1])
+                while len(self._users) > self.max_users:
+                    evicted_user, evicted = self._users.popitem(last=False)
+                    for task_id in evicted.signatures:
+                        self._owners.pop(task_id, None)
+                    self._locks.pop(evicted_user, None)
+        self._locks.pop(user_id, None)
+        return self._users[user_id]
+
+    def sync(self, task: dict):
+        """Reflect a created or updated task; users not yet loaded are read from Mongo later."""
+        index = self._users.get(task['user_id'])
+        if index is None:
+            if task['user_id'] in self._loading:
+                self._loading[task['user_id']].append(("sync", task))
+            return
+        if task.get('completed'):
+            index.remove(task['id'])
+            self._owners.pop(task['id'], None)
+        else:
+            index.add(task['id'], task['title'])
+            self._owners[task['id']] = task['user_id']
+
+    def remove(self, task_id: str):
+        # The owner isn't known until loaded, so every loading user replays it
+        for changes in self._loading.values():
+            changes.append(("remove", task_id))
+        user_id = self._owners.pop(task_id, None)
+        if user_id in self._users:
+            self._users[user_id].remove(task_id)
+
+    async def flag(self, user_id: str, tasks: List["SortedTask"]) -> List["SortedTask"]:
+        index = await self._get(user_id)
+        for task in tasks:
+            match = index.best_match(task.title, self.threshold)
+            if match:
+                task.duplicate_of, task.duplicate_title, _ = match
+        return tasks
+
+task_duplicates = TaskDuplicateIndex(
+    max_users=int(os.environ.get('DUPLICATE_INDEX_MAX_USERS', '1000')),
+    threshold=float(os.environ.get('DUPLICATE_THRESHOLD', '0.5'))
+)
+
+# Read coalescing
+class SingleFlight:
+    """
+    Lets concurrent identical reads share one in-flight Motor call. Keys start
+    with the collection name; writes in this process invalidate the collection
+    so later callers never join a read that raced with the write. With a
+    ttl_ms above zero, finished results are also reused for that long.
+    """
+
+    def __init__(self, ttl_ms: int):
+        self.ttl = ttl_ms / 1000
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._results: Dict[tuple, Tuple[float, object]] = {}
+
+    async def do(self, key: tuple, fetch):
+        cached = self._results.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                return cached[1]
+            del self._results[key]
+        task = self._inflight.get(key)
+        if task is None:
+            # Run the fetch as its own task so a disconnecting leader doesn't cancel it for everyone
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is not task:
+            return
+        del self._inflight[key]
+        if self.ttl > 0 and not task.cancelled() and task.exception() is None:
+            self._results[key] = (time.monotonic() + self.ttl, task.result())
+
+    def invalidate(self, collection: str):
+        for key in [k for k in self._inflight if k[0] == collection]:
+            del self._inflight[key]
+        for key in [k for k in self._results if k[0] == collection]:
+            del self._results[key]
+
+single_flight = SingleFlight(ttl_ms=int(os.environ.get('SINGLE_FLIGHT_TTL_MS', '0')))
+
+# Live change push
+# Open WebSockets (see /ws/{user_id}) receive per-document events for the
+# collections below. With CHANGE_STREAMS=true the events come from a Mongo
+# change stream, so writes made by any API process reach every socket; on a
+# standalone server, or without pre-images to route deletes, the write routes
+# of this process publish their own changes instead.
+LIVE_COLLECTIONS = {"tasks": Task, "bills": Bill, "routines": Routine}
+CHANGE_STREAMS_ENABLED = os.environ.get('CHANGE_STREAMS', 'false').lower() == 'true'
+CHANGE_STREAM_RETRY_SECONDS = 5
+LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE', '256'))
+LIVE_PING_SECONDS = 25
+CHANGE_STREAM_HISTORY_LOST = 286
+
+def live_document(collection: str, doc: dict) -> dict:
+    doc = {k: v for k, v in doc.items() if k != '_id'}
+    if collection == "bills":
+        doc['due_date'] = format_calendar_date(doc['due_date'])
+    return LIVE_COLLECTIONS[collection](**doc).model_dump(mode="json")
+
+class ChangeHub:
+    """
+    Fans change events out to each user's open sockets. A socket that falls
+    queue_size events behind has its backlog replaced by one resync event,
+    telling the client to refetch instead.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.watching = False
+        self.stats = {"published": 0, "resyncs": 0, "unroutable": 0, "errors": 0}
+        self._subscribers: Dict[str, set] = defaultdict(set)
+
+    @property
+    def socket_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[user_id]
+
+    def publish(self, collection: str, op: str, doc: dict):
+        """Called by write routes; skipped while the change stream delivers events."""
+        if not self.watching:
+            self._dispatch(collection, op, doc)
+
+    def _dispatch(self, collection: str, op: str, doc: dict):
+        subscribers = self._subscribers.get(doc.get('user_id'))
+        if not subscribers:
+            return
+        try:
+            event = {"collection": collection, "op": op, "id": doc['id']}
+            if op == "upsert":
+                event["document"] = live_document(collection, doc)
+        except Exception as e:
+            # A document the model rejects must not fail the write that
+            # published it, or stop the change stream; the client refetches
+            logging.error(f"Could not build live event for {collection}: {str(e)}")
+            self.stats["errors"] += 1
+            event = {"op": "resync"}
+        self.stats["published"] += 1
+        for queue in subscribers:
+            self._put(queue, event)
+
+    def _put(self, queue: asyncio.Queue, event: dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"op": "resync"})
+            self.stats["resyncs"] += 1
+
+    def _resync_all(self):
+        for subscribers in self._subscribers.values():
+            for queue in subscribers:
+                self._put(queue, {"op": "resync"})
+
+    async def _enable_pre_images(self) -> bool:
+        # Delete events only carry _id; the pre-image supplies the user to route to
+        try:
+            for collection in LIVE_COLLECTIONS:
+                await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+            return True
+        except OperationFailure as e:
+            logger.warning(f"Change streams disabled, falling back to in-process events: {str(e)}")
+            return False
+
+    async def watch(self):
+        if not await self._enable_pre_images():
+            return
+        try:
+            await self._watch()
+        except Exception as e:
+            logging.error(f"Change stream failed: {str(e)}")
+        finally:
+            if self.watching:
+                # Hand delivery back to publish(); events may have been missed
+                self.watching = False
+                self._resync_all()
+                logger.warning("Change stream stopped; falling back to in-process events")
+
+    async def _watch(self):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(LIVE_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        resume_token = None
+        while True:
+            try:
+                async with db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=resume_token,
+                ) as stream:
+                    if not self.watching:
+                        self.watching = True
+                        # Events published before the stream opened may be missing
+                        self._resync_all()
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        try:
+                            self._apply(change)
+                        except Exception as e:
+                            logging.error(f"Change event error: {str(e)}")
+                            self.stats["errors"] += 1
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAM_HISTORY_LOST:
+                    logging.error(f"Change stream error: {str(e)}")
+                    await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+                    continue
+                logger.warning("Change stream resume point lost; resyncing clients")
+                resume_token = None
+                self._resync_all()
+            except PyMongoError as e:
+                logging.error(f"Change stream error: {str(e)}")
+                await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def _apply(self, change: dict):
+        collection = change['ns']['coll']
+        if change['operationType'] == "delete":
+            op, doc = "delete", change.get('fullDocumentBeforeChange')
+        else:
+            op, doc = "upsert", change.get('fullDocument')
+        if doc is None:
+            # Deleted before the lookup ran (its delete event follows), or no pre-image
+            if op == "delete":
+                self.stats["unroutable"] += 1
+            return
+        if collection == "tasks":
+            # Every worker sees every write here, not just its own
+            if op == "delete":
+                task_duplicates.remove(doc['id'])
+            else:
+                task_duplicates.sync(doc)
+        self._dispatch(collection, op, doc)
+
+change_hub = ChangeHub(queue_size=LIVE_QUEUE_SIZE)
+change_stream_task: Optional[asyncio.Task] = None
+
+# Field projection
+# List routes accept ?fields=a,b,c; only those fields are read from Mongo and
+# validated, through a partial copy of the response model built once per set.
+_partial_adapters: Dict[tuple, TypeAdapter] = {}
+
+def parse_fields(model, fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if fields is None:
+        return None
+    requested = tuple(sorted({field.strip() for field in fields.split(",") if field.strip()}))
+    unknown = [field for field in requested if field not in model.model_fields]
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"fields must be a comma-separated subset of: {', '.join(model.model_fields)}"
+        )
+    return requested
+
+def projection(fields: Optional[Tuple[str, ...]]) -> dict:
+    if fields is None:
+        return {"_id": 0}
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+def partial_response(model, fields: Tuple[str, ...], docs: List[dict]) -> JSONResponse:
+    key = (model.__name__, fields)
+    adapter = _partial_adapters.get(key)
+    if adapter is None:
+        partial_model = create_model(
+            f"{model.__name__}Fields",
+            __config__=ConfigDict(extra="ignore"),
+            **{field: (model.model_fields[field].annotation, model.model_fields[field]) for field in fields}
+        )
+        adapter = _partial_adapters[key] = TypeAdapter(List[partial_model])
+    return JSONResponse(adapter.dump_python(adapter.validate_python(docs), mode="json"))
+
+# Idempotent creates
+# Create routes honour an Idempotency-Key header. The first request claims the
+# key in idempotency_keys (TTL-indexed on created_at), runs, and stores its
+# response; repeats replay it. A repeat that arrives while the original is
+# still running waits for it, in-process through a future, across processes
+# by polling the record. A claim whose owner has held it longer than the
+# lease (say, the process died) can be taken over.
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60'))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+IDEMPOTENCY_REPLAY_HEADER = "Idempotent-Replayed"
+_idempotency_inflight: Dict[str, asyncio.Future] = {}
+
+def request_fingerprint(payload: BaseModel) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+def check_fingerprint(record: dict, fingerprint: str):
+    if record['fingerprint'] != fingerprint:
+        raise HTTPException(status_code=422, detail="This Idempotency-Key was already used for a different request.")
+
+async def claim_idempotency_key(record_id: str, fingerprint: str) -> Optional[dict]:
+    """Returns None once this request owns the key, or the finished record to replay."""
+    remaining = remaining_seconds()
+    wait = IDEMPOTENCY_WAIT_SECONDS if remaining is None else min(IDEMPOTENCY_WAIT_SECONDS, remaining)
+    give_up_at = time.monotonic() + wait
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "status": "in_progress",
+                "created_at": now,
+                "claimed_at": now,
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        inflight = _idempotency_inflight.get(record_id)
+        if inflight is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(inflight), timeout=max(give_up_at - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+        if record is None:
+            # The original failed and released the key
+            continue
+        check_fingerprint(record, fingerprint)
+        if record['status'] == "done":
+            return record
+        taken_over = await db.idempotency_keys.update_one(
+            {"_id": record_id, "status": "in_progress", "claimed_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}},
+            {"$set": {"claimed_at": now}}
+        )
+        if taken_over.modified_count:
+            return None
+        if time.monotonic() >= give_up_at:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress. Please try again in a moment."
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+async def run_idempotent(scope: str, user_id: str, key: Optional[str], payload: BaseModel, create):
+    if not key:
+        return await create()
+    record_id = f"{scope}:{user_id}:{key}"
+    fingerprint = request_fingerprint(payload)
+    record = await claim_idempotency_key(record_id, fingerprint)
+    if record is not None:
+        return JSONResponse(record['response'], headers={IDEMPOTENCY_REPLAY_HEADER: "true"})
+
+    # Waiters only need to know the original finished; they read the outcome
+    # from the record (or find the key released and claim it themselves)
+    finished = asyncio.get_running_loop().create_future()
+    _idempotency_inflight[record_id] = finished
+    try:
+        result = await create()
+        await db.idempotency_keys.update_one(
+            {"_id": record_id},
+            {"$set": {"status": "done", "response": jsonable_encoder(result), "completed_at": datetime.now(timezone.utc)}}
+        )
+        return result
+    except BaseException:
+        # Release the key so a retry runs the request again
+        await db.idempotency_keys.delete_one({"_id": record_id, "status": "in_progress"})
+        raise
+    finally:
+        _idempotency_inflight.pop(record_id, None)
+        finished.set_result(None)
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -302,7 +1627,6 @@ async def root():
 async def create_user(user: UserCreate):
     user_obj = User(**user.model_dump())
     doc = user_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.users.insert_one(doc)
     return user_obj
 
@@ -320,7 +1644,6 @@ async def get_user(user_id: str):
 async def save_onboarding_profile(profile: OnboardingProfileCreate):
     profile_obj = OnboardingProfile(**profile.model_dump())
     doc = profile_obj.model_dump()
-    doc['completed_at'] = doc['completed_at'].isoformat()
     
     # Check if profile already exists for this user
     existing = await db.onboarding_profiles.find_one({"user_id": profile_obj.user_id})
@@ -347,41 +1670,78 @@ async def get_onboarding_profile(user_id: str):
 
 # Task routes
 @api_router.post("/tasks", response_model=Task)
-async def create_task(task: TaskCreate):
-    task_obj = Task(**task.model_dump())
-    doc = task_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.tasks.insert_one(doc)
-    return task_obj
+async def create_task(task: TaskCreate, response: Response, idempotency_key: Optional[str] = Header(None)):
+    async def create():
+        task_obj = Task(**task.model_dump())
+        doc = task_obj.model_dump()
+        async with await causal_session() as session:
+            await db.tasks.insert_one(doc, session=session)
+            set_causal_token(response, session)
+        single_flight.invalidate("tasks")
+        task_duplicates.sync(doc)
+        change_hub.publish("tasks", "upsert", doc)
+        return task_obj
+
+    return await run_idempotent("tasks", task.user_id, idempotency_key, task, create)
 
 @api_router.get("/tasks/{user_id}", response_model=List[Task])
-async def get_tasks(user_id: str, category: Optional[str] = None):
+async def get_tasks(
+    user_id: str,
+    category: Optional[str] = None,
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    x_causal_token: Optional[str] = Header(None),
+):
+    selected = parse_fields(Task, fields)
     query = {"user_id": user_id}
     if category:
         query["category"] = category
-    tasks = await db.tasks.find(query, {"_id": 0}).to_list(1000)
-    for task in tasks:
-        if isinstance(task['created_at'], str):
-            task['created_at'] = datetime.fromisoformat(task['created_at'])
+
+    async def fetch():
+        async with await causal_session(x_causal_token) as session:
+            tasks = await read_db.tasks.find(query, projection(selected), session=session).to_list(1000)
+            if include_archived:
+                tasks += await read_db.tasks_archive.find(query, projection(selected), session=session).to_list(1000)
+        for task in tasks:
+            for field in ('created_at', 'completed_at'):
+                if isinstance(task.get(field), str):
+                    task[field] = datetime.fromisoformat(task[field])
+        return tasks
+
+    tasks = await single_flight.do(("tasks", user_id, category, include_archived, selected, x_causal_token), fetch)
+    if selected is not None:
+        return partial_response(Task, selected, tasks)
     return tasks
 
 @api_router.patch("/tasks/{task_id}", response_model=Task)
-async def update_task(task_id: str, update: TaskUpdate):
-    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
-    if update_data:
-        await db.tasks.update_one({"id": task_id}, {"$set": update_data})
-    task = await db.tasks.find_one({"id": task_id}, {"_id": 0})
+async def update_task(task_id: str, update: TaskUpdate, response: Response):
+    update_data = task_update_fields(update)
+    async with await causal_session() as session:
+        if update_data:
+            await db.tasks.update_one({"id": task_id}, {"$set": update_data}, session=session)
+            single_flight.invalidate("tasks")
+        task = await read_db.tasks.find_one({"id": task_id}, {"_id": 0}, session=session)
+        set_causal_token(response, session)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    if isinstance(task['created_at'], str):
-        task['created_at'] = datetime.fromisoformat(task['created_at'])
+    task_duplicates.sync(task)
+    if update_data:
+        change_hub.publish("tasks", "upsert", task)
+    for field in ('created_at', 'completed_at'):
+        if isinstance(task.get(field), str):
+            task[field] = datetime.fromisoformat(task[field])
     return task
 
 @api_router.delete("/tasks/{task_id}")
-async def delete_task(task_id: str):
-    result = await db.tasks.delete_one({"id": task_id})
-    if result.deleted_count == 0:
+async def delete_task(task_id: str, response: Response):
+    async with await causal_session() as session:
+        task = await db.tasks.find_one_and_delete({"id": task_id}, {"_id": 0}, session=session)
+        set_causal_token(response, session)
+    single_flight.invalidate("tasks")
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    task_duplicates.remove(task_id)
+    change_hub.publish("tasks", "delete", task)
     return {"message": "Task deleted"}
 
 # Routine routes
@@ -389,8 +1749,8 @@ async def delete_task(task_id: str):
 async def create_routine(routine: RoutineCreate):
     routine_obj = Routine(**routine.model_dump())
     doc = routine_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.routines.insert_one(doc)
+    change_hub.publish("routines", "upsert", doc)
     return routine_obj
 
 @api_router.get("/routines/{user_id}", response_model=List[Routine])
@@ -403,7 +1763,14 @@ async def get_routines(user_id: str):
 
 @api_router.patch("/routines/{routine_id}/complete")
 async def complete_routine(routine_id: str):
-    await db.routines.update_one({"id": routine_id}, {"$set": {"completed_today": True}})
+    routine = await db.routines.find_one_and_update(
+        {"id": routine_id},
+        {"$set": {"completed_today": True}},
+        {"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if routine:
+        change_hub.publish("routines", "upsert", routine)
     return {"message": "Routine marked complete"}
 
 @api_router.patch("/routines/{routine_id}", response_model=Routine)
@@ -414,74 +1781,296 @@ async def update_routine(routine_id: str, update: RoutineCreate):
     routine = await db.routines.find_one({"id": routine_id}, {"_id": 0})
     if not routine:
         raise HTTPException(status_code=404, detail="Routine not found")
+    change_hub.publish("routines", "upsert", routine)
     if isinstance(routine['created_at'], str):
         routine['created_at'] = datetime.fromisoformat(routine['created_at'])
     return routine
 
 @api_router.delete("/routines/{routine_id}")
 async def delete_routine(routine_id: str):
-    result = await db.routines.delete_one({"id": routine_id})
-    if result.deleted_count == 0:
+    routine = await db.routines.find_one_and_delete({"id": routine_id}, {"_id": 0})
+    if routine is None:
         raise HTTPException(status_code=404, detail="Routine not found")
+    change_hub.publish("routines", "delete", routine)
     return {"message": "Routine deleted"}
 
 # Bill routes
 @api_router.post("/bills", response_model=Bill)
-async def create_bill(bill: BillCreate):
-    bill_obj = Bill(**bill.model_dump())
-    doc = bill_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.bills.insert_one(doc)
-    return bill_obj
+async def create_bill(bill: BillCreate, idempotency_key: Optional[str] = Header(None)):
+    async def create():
+        bill_obj = Bill(**bill.model_dump())
+        doc = bill_obj.model_dump()
+        doc['due_date'] = parse_calendar_date(doc['due_date'])
+        await db.bills.insert_one(doc)
+        single_flight.invalidate("bills")
+        change_hub.publish("bills", "upsert", doc)
+        return bill_obj
+
+    return await run_idempotent("bills", bill.user_id, idempotency_key, bill, create)
 
 @api_router.get("/bills/{user_id}", response_model=List[Bill])
-async def get_bills(user_id: str):
-    bills = await db.bills.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
-    for bill in bills:
-        if isinstance(bill['created_at'], str):
-            bill['created_at'] = datetime.fromisoformat(bill['created_at'])
+async def get_bills(user_id: str, fields: Optional[str] = None):
+    selected = parse_fields(Bill, fields)
+
+    async def fetch():
+        bills = await db.bills.find({"user_id": user_id}, projection(selected)).to_list(1000)
+        for bill in bills:
+            if isinstance(bill.get('created_at'), str):
+                bill['created_at'] = datetime.fromisoformat(bill['created_at'])
+            if 'due_date' in bill:
+                bill['due_date'] = format_calendar_date(bill['due_date'])
+        return bills
+
+    bills = await single_flight.do(("bills", user_id, selected), fetch)
+    if selected is not None:
+        return partial_response(Bill, selected, bills)
     return bills
 
 @api_router.patch("/bills/{bill_id}/pay")
 async def pay_bill(bill_id: str):
-    await db.bills.update_one({"id": bill_id}, {"$set": {"paid": True}})
+    bill = await db.bills.find_one_and_update(
+        {"id": bill_id},
+        {"$set": {"paid": True}},
+        {"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    single_flight.invalidate("bills")
+    if bill:
+        change_hub.publish("bills", "upsert", bill)
     return {"message": "Bill marked as paid"}
 
 @api_router.patch("/bills/{bill_id}", response_model=Bill)
 async def update_bill(bill_id: str, update: BillCreate):
     update_data = update.model_dump()
+    update_data['due_date'] = parse_calendar_date(update_data['due_date'])
     if update_data:
         await db.bills.update_one({"id": bill_id}, {"$set": update_data})
+        single_flight.invalidate("bills")
     bill = await db.bills.find_one({"id": bill_id}, {"_id": 0})
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
+    change_hub.publish("bills", "upsert", bill)
     if isinstance(bill['created_at'], str):
         bill['created_at'] = datetime.fromisoformat(bill['created_at'])
+    bill['due_date'] = format_calendar_date(bill['due_date'])
     return bill
 
 @api_router.delete("/bills/{bill_id}")
 async def delete_bill(bill_id: str):
-    result = await db.bills.delete_one({"id": bill_id})
-    if result.deleted_count == 0:
+    bill = await db.bills.find_one_and_delete({"id": bill_id}, {"_id": 0})
+    single_flight.invalidate("bills")
+    if bill is None:
         raise HTTPException(status_code=404, detail="Bill not found")
+    change_hub.publish("bills", "delete", bill)
     return {"message": "Bill deleted"}
 
 # Energy check-in routes
 @api_router.post("/energy", response_model=EnergyCheckIn)
-async def create_energy_checkin(checkin: EnergyCheckInCreate):
-    checkin_obj = EnergyCheckIn(**checkin.model_dump())
-    doc = checkin_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.energy_checkins.insert_one(doc)
-    return checkin_obj
+async def create_energy_checkin(checkin: EnergyCheckInCreate, idempotency_key: Optional[str] = Header(None)):
+    async def create():
+        checkin_obj = EnergyCheckIn(**checkin.model_dump())
+        doc = checkin_obj.model_dump()
+        await db.energy_checkins.insert_one(doc)
+        return checkin_obj
+
+    return await run_idempotent("energy", checkin.user_id, idempotency_key, checkin, create)
 
 @api_router.get("/energy/{user_id}", response_model=List[EnergyCheckIn])
 async def get_energy_checkins(user_id: str):
-    checkins = await db.energy_checkins.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).limit(30).to_list(30)
-    for checkin in checkins:
-        if isinstance(checkin['created_at'], str):
-            checkin['created_at'] = datetime.fromisoformat(checkin['created_at'])
-    return checkins
+    return await find_chronological(read_db.energy_checkins, {"user_id": user_id}, {"_id": 0}, "created_at", -1, 30)
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: returns the indices of at most `threshold`
+    points that preserve the visual shape of the series. `x` must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket boundaries for the n-2 interior points
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the triangle area between the previous pick, each candidate and the next bucket's mean
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+@api_router.get("/energy/{user_id}/trend", response_model=EnergyTrendResponse)
+async def get_energy_trend(
+    user_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: int = Query(200, ge=3, le=2000),
+):
+    query = {"user_id": user_id}
+    created_range = {}
+    if start:
+        created_range["$gte"] = to_utc(start)
+    if end:
+        created_range["$lte"] = to_utc(end)
+    if created_range:
+        query.update(date_condition("created_at", created_range))
+
+    checkins = await find_chronological(
+        read_db.energy_checkins, query, {"_id": 0, "created_at": 1, "energy_level": 1}, "created_at", 1, None
+    )
+    x = np.asarray([checkin['created_at'].timestamp() for checkin in checkins], dtype=np.float64)
+    y = np.asarray([checkin['energy_level'] for checkin in checkins], dtype=np.float64)
+    # lttb_downsample needs x sorted; equal timestamps keep their read order
+    order = np.argsort(x, kind="stable")
+    x, y = x[order], y[order]
+    points = [
+        EnergyTrendPoint(
+            created_at=datetime.fromtimestamp(x[i], tz=timezone.utc),
+            energy_level=y[i]
+        )
+        for i in lttb_downsample(x, y, max_points)
+    ]
+    return EnergyTrendResponse(
+        points=points,
+        total_checkins=len(x),
+        downsampled=len(points) < len(x)
+    )
+
+# Chat message persistence
+class WriteBehindBuffer:
+    """
+    Collects inserts for one collection across requests and writes them with
+    insert_many, flushing when max_batch documents are waiting, every
+    flush_ms, and on shutdown. Durable adds only return once their batch is
+    written; others return immediately. A failed batch is retried once; if
+    that fails too, durable adds get the error and the rest are put back to
+    be retried on the next flush.
+    """
+
+    def __init__(self, collection_name: str, max_batch: int, flush_ms: int, durable: bool):
+        self.collection_name = collection_name
+        self.max_batch = max_batch
+        self.flush_interval = flush_ms / 1000
+        self.durable = durable
+        self.stats = {
+            "flushes": 0,
+            "documents": 0,
+            "errors": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._pending: List[Tuple[dict, Optional[asyncio.Future]]] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def add(self, doc: dict, durable: Optional[bool] = None):
+        durable = self.durable if durable is None else durable
+        future = asyncio.get_running_loop().create_future() if durable else None
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        if future is not None:
+            await future
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                started = time.perf_counter()
+                try:
+                    try:
+                        await self._insert([doc for doc, _ in batch])
+                    except Exception as e:
+                        logging.warning(f"Write-behind flush to {self.collection_name} failed, retrying: {str(e)}")
+                        await self._insert([doc for doc, _ in batch])
+                except Exception as e:
+                    logging.error(f"Write-behind flush to {self.collection_name} failed: {str(e)}")
+                    self.stats["errors"] += 1
+                    retry = []
+                    for doc, future in batch:
+                        if future is None:
+                            retry.append((doc, None))
+                        elif not future.done():
+                            future.set_exception(e)
+                    # Back to the front, keeping order; the next flush tries again
+                    self._pending[:0] = retry
+                    break
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.stats["flushes"] += 1
+                self.stats["documents"] += len(batch)
+                self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+                self.stats["last_flush_ms"] = elapsed_ms
+                self.stats["total_flush_ms"] += elapsed_ms
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_result(None)
+
+    async def _insert(self, docs: List[dict]):
+        try:
+            await db[self.collection_name].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # insert_many assigns each doc its _id on the first attempt, so on
+            # a retry the documents that did get written fail as duplicates
+            if e.details.get("writeConcernErrors") or any(
+                error.get("code") != 11000 for error in e.details.get("writeErrors", [])
+            ):
+                raise
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Let the loop finish the flush it may be in rather than cancelling
+        # it with a batch already taken off _pending
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logging.error(f"Write-behind buffer for {self.collection_name} stopped with {len(self._pending)} unsaved documents")
+
+    def metrics(self) -> dict:
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "durable": self.durable,
+            "avg_batch_size": self.stats["documents"] / flushes if flushes else 0.0,
+            "avg_flush_ms": self.stats["total_flush_ms"] / flushes if flushes else 0.0,
+        }
+
+chat_writes = WriteBehindBuffer(
+    "chat_messages",
+    max_batch=int(os.environ.get('CHAT_WRITE_BATCH_SIZE', '100')),
+    flush_ms=int(os.environ.get('CHAT_WRITE_FLUSH_MS', '50')),
+    durable=os.environ.get('CHAT_WRITE_DURABLE', 'false').lower() == 'true'
+)
 
 # Chat routes
 @api_router.post("/chat", response_model=ChatResponse)
@@ -494,20 +2083,20 @@ async def chat(request: ChatRequest):
         content=request.message
     )
     user_doc = user_msg.model_dump()
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
-    await db.chat_messages.insert_one(user_doc)
+    await chat_writes.add(user_doc)
     
     # Call AI with reflective listener prompt (presence only, no action)
     try:
-        chat_client = LlmChat(
+        llm = await load_llm_module()
+        chat_client = llm.LlmChat(
             api_key=os.environ.get('EMERGENT_LLM_KEY'),
             session_id=request.session_id,
             system_message=REFLECTIVE_LISTENER_PROMPT
         ).with_model("openai", "gpt-5.1")
         
         # Send only the user's message - no task context for reflective listening
-        user_message = UserMessage(text=request.message)
-        response = await chat_client.send_message(user_message)
+        user_message = llm.UserMessage(text=request.message)
+        response = await send_llm_message(chat_client, user_message)
         
         # Save assistant message
         assistant_msg = ChatMessage(
@@ -517,135 +2106,1688 @@ async def chat(request: ChatRequest):
             content=response
         )
         assistant_doc = assistant_msg.model_dump()
-        assistant_doc['created_at'] = assistant_doc['created_at'].isoformat()
-        await db.chat_messages.insert_one(assistant_doc)
+        await chat_writes.add(assistant_doc)
         
         return ChatResponse(message=response, created_at=assistant_msg.created_at)
     except Exception as e:
+        if is_deadline_error(e):
+            raise HTTPException(status_code=504, detail="This is taking longer than usual. Please try again in a moment.")
         logging.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 @api_router.get("/chat/history/{user_id}/{session_id}", response_model=List[ChatMessage])
-async def get_chat_history(user_id: str, session_id: str):
-    messages = await db.chat_messages.find(
-        {"user_id": user_id, "session_id": session_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(1000)
-    for msg in messages:
-        if isinstance(msg['created_at'], str):
-            msg['created_at'] = datetime.fromisoformat(msg['created_at'])
+async def get_chat_history(user_id: str, session_id: str, include_archived: bool = False):
+    # Make this process's buffered messages visible before reading. They were
+    # just written to the primary, so read there: a secondary may lag behind.
+    await chat_writes.flush()
+    messages = await find_chronological(
+        db.chat_messages, {"user_id": user_id, "session_id": session_id}, {"_id": 0}, "created_at", 1, 1000
+    )
+    if include_archived:
+        messages = await load_archived_chat(user_id, session_id) + messages
     return messages
 
+@api_router.get("/metrics/chat-writes")
+async def get_chat_write_metrics():
+    return chat_writes.metrics()
+
 # Brain Offload routes
+# Short, unambiguous dumps ("buy milk tomorrow") are sorted locally from time
+# keywords; anything the rules aren't sure about goes to the LLM.
+OFFLOAD_FAST_PATH_ENABLED = os.environ.get('OFFLOAD_FAST_PATH', 'true').lower() == 'true'
+OFFLOAD_FAST_PATH_MAX_CHARS = 300
+OFFLOAD_FAST_PATH_MAX_ITEMS = 5
+OFFLOAD_FAST_PATH_MAX_WORDS = 10
+_WEEKDAYS = r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|mon|tues?|thu|thurs|fri"
+OFFLOAD_TIME_KEYWORDS = {
+    "today": r"today|tonight|this (?:morning|afternoon|evening)|asap|right now",
+    "this_week": rf"tomorrow|tmrw|this week(?:end)?|(?:the )?weekend|{_WEEKDAYS}|in a (?:few|couple of) days",
+    "later": r"someday|some day|one day|eventually|later|next (?:week|month|year)|at some point",
+}
+_OFFLOAD_KEYWORD_RES = {
+    category: re.compile(rf"(?:\b(?:on|by|before|until|for)\s+)?\b(?:{pattern})\b", re.IGNORECASE)
+    for category, pattern in OFFLOAD_TIME_KEYWORDS.items()
+}
+_OFFLOAD_SPLIT_RE = re.compile(r"[\n;,]+|(?:^|\s)[-*•]\s+")
+# Items opening like feelings or questions aren't tasks the rules can name
+_OFFLOAD_NON_TASK_STARTS = {
+    "i", "i'm", "im", "i've", "i'd", "we", "we're", "it", "it's", "this", "that", "so",
+    "feeling", "feel", "why", "how", "what", "maybe", "worried", "stressed", "tired",
+}
+
+# What removing the time keyword can leave at the ends ("Later: sort garage")
+_OFFLOAD_EDGE_PUNCTUATION = " .!-:;,\u2013\u2014"
+_OFFLOAD_DANGLING_WORDS = {"and", "or", "then", "also"}
+
+offload_stats = {"fast_path": 0, "llm": 0}
+
+def clean_offload_title(text: str) -> str:
+    words = re.sub(r"\s+", " ", text).strip(_OFFLOAD_EDGE_PUNCTUATION).split()
+    while words and words[0].lower() in _OFFLOAD_DANGLING_WORDS:
+        words = " ".join(words[1:]).strip(_OFFLOAD_EDGE_PUNCTUATION).split()
+    while words and words[-1].lower() in _OFFLOAD_DANGLING_WORDS:
+        words = " ".join(words[:-1]).strip(_OFFLOAD_EDGE_PUNCTUATION).split()
+    return " ".join(words)
+
+def fast_sort_offload(raw_text: str) -> Optional[List[SortedTask]]:
+    """Returns sorted tasks when every item is unambiguous, otherwise None."""
+    if not OFFLOAD_FAST_PATH_ENABLED or len(raw_text) > OFFLOAD_FAST_PATH_MAX_CHARS or "?" in raw_text:
+        return None
+    items = [item.strip() for item in _OFFLOAD_SPLIT_RE.split(raw_text) if item and item.strip()]
+    if not items or len(items) > OFFLOAD_FAST_PATH_MAX_ITEMS:
+        return None
+
+    sorted_tasks = []
+    for item in items:
+        words = item.lower().split()
+        if len(words) > OFFLOAD_FAST_PATH_MAX_WORDS or words[0] in _OFFLOAD_NON_TASK_STARTS:
+            return None
+        matched = [category for category, pattern in _OFFLOAD_KEYWORD_RES.items() if pattern.search(item)]
+        if len(matched) != 1:
+            return None
+        title = clean_offload_title(_OFFLOAD_KEYWORD_RES[matched[0]].sub("", item))
+        if not title:
+            return None
+        sorted_tasks.append(SortedTask(title=title[0].upper() + title[1:], category=matched[0]))
+    return sorted_tasks
+
+def parse_offload_response(response: str) -> List[SortedTask]:
+    # Extract JSON from the response (in case there's extra text)
+    json_match = re.search(r'\[.*\]', response, re.DOTALL)
+    if json_match:
+        tasks_data = json.loads(json_match.group())
+    else:
+        tasks_data = json.loads(response)
+    return [SortedTask(**task) for task in tasks_data]
+
+class IncrementalJsonArray:
+    """
+    Pulls complete elements out of a JSON array while its text is still
+    arriving. Prose before the array is skipped, and elements that don't
+    parse (or never close) are dropped instead of failing the whole reply.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+        self._text = ""
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element_start = 0
+        self._parsed_any = False
+
+    def feed(self, chunk: str) -> list:
+        self._text += chunk
+        text, i, elements = self._text, self._pos, []
+        while i < len(text) and not self._finished:
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif not self._started:
+                self._started = ch == "["
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "}]" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        elements.append(json.loads(text[self._element_start:i + 1]))
+                        self._parsed_any = True
+                    except ValueError:
+                        self.dropped += 1
+            elif ch == "]":
+                # A bracketed aside in the preamble isn't the array we want
+                self._finished = self._parsed_any
+                self._started = self._parsed_any
+            i += 1
+
+        # Keep only the unfinished element so the buffer stays small
+        keep = self._element_start if self._depth else i
+        self._text = text[keep:]
+        self._pos = i - keep
+        self._element_start = self._element_start - keep if self._depth else 0
+        return elements
+
+OFFLOAD_LLM_PROVIDER = "openai"
+OFFLOAD_LLM_MODEL = "gpt-5.1"
+
+def offload_chat_client(llm, user_id: str):
+    return llm.LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id="brain-offload-" + user_id,
+        system_message=BRAIN_OFFLOAD_PROMPT
+    ).with_model(OFFLOAD_LLM_PROVIDER, OFFLOAD_LLM_MODEL)
+
+async def llm_sort_offload(user_id: str, raw_text: str) -> List[SortedTask]:
+    llm = await load_llm_module()
+    chat_client = offload_chat_client(llm, user_id)
+    
+    user_message = llm.UserMessage(text=f"Here's what's on my mind:\n\n{raw_text}")
+    response = await send_llm_message(chat_client, user_message)
+    return parse_offload_response(response)
+
+async def llm_stream_offload(user_id: str, raw_text: str):
+    """Yields each SortedTask as soon as the model has finished writing it."""
+    llm = await load_llm_module()
+    chat_client = offload_chat_client(llm, user_id)
+    user_message = llm.UserMessage(text=f"Here's what's on my mind:\n\n{raw_text}")
+
+    parser = IncrementalJsonArray()
+    reply = []
+    emitted = 0
+    chunks = stream_llm_message(
+        chat_client, user_message, BRAIN_OFFLOAD_PROMPT, OFFLOAD_LLM_PROVIDER, OFFLOAD_LLM_MODEL
+    )
+    async for chunk in chunks:
+        reply.append(chunk)
+        for element in parser.feed(chunk):
+            try:
+                task = SortedTask(**element)
+            except (TypeError, ValueError):
+                parser.dropped += 1
+                continue
+            emitted += 1
+            yield task
+    if parser.dropped:
+        logging.warning(f"Brain offload stream dropped {parser.dropped} malformed tasks")
+    if not emitted:
+        # Nothing array-shaped streamed; give the whole reply the lenient parse
+        for task in parse_offload_response("".join(reply)):
+            yield task
+
+class OffloadBatcher:
+    """
+    Gathers concurrent LLM-bound offloads for a short window (or until
+    max_items are waiting) and sorts them with one multi-document prompt.
+    Documents the batched reply doesn't cover are retried individually by
+    their own caller.
+
+    The batch serves several requests, so it runs in a fresh context with its
+    own timeout_ms rather than inheriting the deadline of whichever request
+    happened to trigger the flush. Each caller still waits no longer than its
+    own deadline.
+    """
+
+    def __init__(self, window_ms: int, max_items: int, timeout_ms: int):
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.timeout = timeout_ms / 1000
+        self.stats = {"batches": 0, "batched_requests": 0, "fallbacks": 0}
+        self._pending: List[Tuple[str, str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_items > 1
+
+    async def submit(self, user_id: str, raw_text: str) -> List[SortedTask]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((user_id, raw_text, future))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush, context=Context())
+        try:
+            tasks = await asyncio.wait_for(future, timeout=remaining_seconds())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Batched brain offload exceeded the request deadline")
+        if tasks is None:
+            # Not covered by the batch; sort it alone on this request's budget
+            return await llm_sort_offload(user_id, raw_text)
+        return tasks
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch), context=Context())
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        results = [None] * len(batch)
+        if len(batch) > 1:
+            request_deadline.set(time.monotonic() + self.timeout)
+            try:
+                with pymongo.timeout(self.timeout):
+                    results = await self._sort_batch(batch)
+                self.stats["batches"] += 1
+                self.stats["batched_requests"] += sum(r is not None for r in results)
+            except Exception as e:
+                logging.warning(f"Batched brain offload failed, retrying individually: {str(e)}")
+        for (user_id, raw_text, future), tasks in zip(batch, results):
+            if future.done():
+                continue
+            if tasks is None and len(batch) > 1:
+                self.stats["fallbacks"] += 1
+            # None sends the caller to sort the document itself
+            future.set_result(tasks)
+
+    async def _sort_batch(self, batch) -> List[Optional[List[SortedTask]]]:
+        # Strip delimiter look-alikes so one document can't spill into another
+        documents = "\n\n".join(
+            f"<<<DOC {i}>>>\n{raw_text.replace('<<<', '').replace('>>>', '')}\n<<<END DOC {i}>>>"
+            for i, (_, raw_text, _) in enumerate(batch, 1)
+        )
+        llm = await load_llm_module()
+        chat_client = llm.LlmChat(
+            api_key=os.environ.get('EMERGENT_LLM_KEY'),
+            session_id=f"brain-offload-batch-{uuid.uuid4()}",
+            system_message=BRAIN_OFFLOAD_BATCH_PROMPT
+        ).with_model("openai", "gpt-5.1")
+        response = await send_llm_message(chat_client, llm.UserMessage(text=documents))
+
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        parsed = json.loads(json_match.group() if json_match else response)
+        results = []
+        for i in range(1, len(batch) + 1):
+            try:
+                results.append([SortedTask(**task) for task in parsed[str(i)]])
+            except Exception:
+                results.append(None)
+        return results
+
+offload_batcher = OffloadBatcher(
+    window_ms=int(os.environ.get('OFFLOAD_BATCH_WINDOW_MS', '0')),
+    max_items=int(os.environ.get('OFFLOAD_BATCH_MAX_ITEMS', '8')),
+    timeout_ms=int(os.environ.get('OFFLOAD_BATCH_TIMEOUT_MS', str(DEADLINES_MS["llm"])))
+)
+
 @api_router.post("/brain-offload", response_model=BrainOffloadResponse)
 async def organize_brain_offload(request: BrainOffloadRequest):
     """
     Takes raw stream-of-consciousness text and uses AI to sort it into tasks
     categorized as Today, This Week, or Later
     """
-    
-    brain_offload_prompt = """You are The Attic Mind's gentle organizing assistant. A user has shared their thoughts, worries, and to-dos in a stream-of-consciousness way. Your job is to:
-
-1. Extract actionable tasks from their text
-2. Sort each task into one of three categories:
-   - "today" - things that feel urgent or time-sensitive for today
-   - "this_week" - things that matter this week but don't need immediate attention
-   - "later" - things to remember but can wait
-
-3. Keep task titles SHORT (3-8 words), clear, and gentle
-4. Don't add tasks that aren't in the original text
-5. If something is vague, interpret it kindly
-
-Return ONLY a JSON array in this exact format:
-[
-  {"title": "Task description", "category": "today"},
-  {"title": "Another task", "category": "this_week"},
-  {"title": "Future item", "category": "later"}
-]
-
-Do not include any other text, explanations, or markdown - just the JSON array."""
-
     try:
-        chat_client = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id="brain-offload-" + request.user_id,
-            system_message=brain_offload_prompt
-        ).with_model("openai", "gpt-5.1")
-        
-        user_message = UserMessage(text=f"Here's what's on my mind:\n\n{request.raw_text}")
-        response = await chat_client.send_message(user_message)
-        
-        # Parse the JSON response
-        import json
-        import re
-        
-        # Extract JSON from the response (in case there's extra text)
-        json_match = re.search(r'\[.*\]', response, re.DOTALL)
-        if json_match:
-            tasks_data = json.loads(json_match.group())
+        sorted_tasks = fast_sort_offload(request.raw_text)
+        if sorted_tasks is None:
+            offload_stats["llm"] += 1
+            if offload_batcher.enabled:
+                sorted_tasks = await offload_batcher.submit(request.user_id, request.raw_text)
+            else:
+                sorted_tasks = await llm_sort_offload(request.user_id, request.raw_text)
         else:
-            tasks_data = json.loads(response)
-        
-        sorted_tasks = [SortedTask(**task) for task in tasks_data]
+            offload_stats["fast_path"] += 1
+        await task_duplicates.flag(request.user_id, sorted_tasks)
         
         return BrainOffloadResponse(tasks=sorted_tasks)
         
     except Exception as e:
+        if is_deadline_error(e):
+            raise HTTPException(status_code=504, detail="Sorting is taking longer than usual. Please try again in a moment.")
         logging.error(f"Brain offload error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error organizing thoughts: {str(e)}")
 
+async def aiter_list(items):
+    for item in items:
+        yield item
+
+@api_router.post("/brain-offload/stream")
+async def stream_brain_offload(request: BrainOffloadRequest):
+    """
+    Same sorting as /brain-offload, streamed as NDJSON: a {"task": ...} line
+    per task as soon as it is ready, then {"done": true} or {"error": ...}.
+    LLM-sorted tasks arrive as the model writes them when streaming is
+    configured (see stream_llm_message), otherwise together at the end.
+    """
+    async def generate():
+        count = 0
+        try:
+            sorted_tasks = fast_sort_offload(request.raw_text)
+            if sorted_tasks is not None:
+                offload_stats["fast_path"] += 1
+                tasks = aiter_list(sorted_tasks)
+            else:
+                offload_stats["llm"] += 1
+                tasks = llm_stream_offload(request.user_id, request.raw_text)
+            async for task in tasks:
+                await task_duplicates.flag(request.user_id, [task])
+                count += 1
+                yield json.dumps({"task": task.model_dump()}) + "\n"
+        except Exception as e:
+            if is_deadline_error(e):
+                detail = "Sorting is taking longer than usual. Please try again in a moment."
+            else:
+                logging.error(f"Brain offload stream error: {str(e)}")
+                detail = "Error organizing thoughts"
+            yield json.dumps({"error": detail, "count": count}) + "\n"
+            return
+        yield json.dumps({"done": True, "count": count}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@api_router.get("/brain-offload/stats")
+async def get_brain_offload_stats():
+    total = offload_stats["fast_path"] + offload_stats["llm"]
+    return {
+        **offload_stats,
+        "total": total,
+        "fast_path_ratio": offload_stats["fast_path"] / total if total else 0.0,
+        "batching": {"enabled": offload_batcher.enabled, **offload_batcher.stats}
+    }
+
 # Weekly Reset routes
 @api_router.post("/weekly-reset", response_model=WeeklyReset)
 async def create_weekly_reset(reset: WeeklyResetCreate):
     reset_obj = WeeklyReset(**reset.model_dump())
     doc = reset_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.weekly_resets.insert_one(doc)
     return reset_obj
 
 @api_router.get("/weekly-reset/{user_id}", response_model=List[WeeklyReset])
 async def get_weekly_resets(user_id: str):
-    resets = await db.weekly_resets.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).limit(10).to_list(10)
-    for reset in resets:
-        if isinstance(reset['created_at'], str):
-            reset['created_at'] = datetime.fromisoformat(reset['created_at'])
-    return resets
+    return await find_chronological(read_db.weekly_resets, {"user_id": user_id}, {"_id": 0}, "created_at", -1, 10)
 
 # Morning Check-In routes
 @api_router.post("/morning-checkin", response_model=MorningCheckIn)
-async def create_morning_checkin(checkin: MorningCheckInCreate):
-    checkin_obj = MorningCheckIn(**checkin.model_dump())
-    doc = checkin_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.morning_checkins.insert_one(doc)
-    return checkin_obj
+async def create_morning_checkin(checkin: MorningCheckInCreate, idempotency_key: Optional[str] = Header(None)):
+    async def create():
+        checkin_obj = MorningCheckIn(**checkin.model_dump())
+        doc = checkin_obj.model_dump()
+        doc['date'] = parse_calendar_date(doc['date'])
+        await db.morning_checkins.insert_one(doc)
+        return checkin_obj
+
+    return await run_idempotent("morning_checkins", checkin.user_id, idempotency_key, checkin, create)
 
 @api_router.get("/morning-checkin/{user_id}/{date}")
 async def get_morning_checkin(user_id: str, date: str):
-    checkin = await db.morning_checkins.find_one({"user_id": user_id, "date": date}, {"_id": 0})
+    dates = [date]
+    parsed_date = parse_calendar_date(date)
+    if isinstance(parsed_date, datetime):
+        dates.append(parsed_date)
+    checkin = await db.morning_checkins.find_one({"user_id": user_id, "date": {"$in": dates}}, {"_id": 0})
     if checkin:
         if isinstance(checkin.get('created_at'), str):
             checkin['created_at'] = datetime.fromisoformat(checkin['created_at'])
+        checkin['date'] = format_calendar_date(checkin['date'])
     return checkin
 
+# Search routes
+# Each collection carries a compound text index prefixed by user_id (see
+# ensure_indexes), so a $text query scoped to one user only touches that
+# user's index entries.
+SEARCHABLE_COLLECTIONS = {
+    "chat_messages": ["content"],
+    "tasks": ["title", "description"],
+    "weekly_resets": ["wins", "challenges"],
+}
+
+@api_router.get("/search/{user_id}", response_model=SearchResponse)
+async def search(
+    user_id: str,
+    q: str = Query(..., min_length=1),
+    offset: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=50),
+):
+    # Each collection only needs to supply enough hits to fill the requested page
+    window = offset + limit + 1
+    results = []
+    for collection, fields in SEARCHABLE_COLLECTIONS.items():
+        cursor = db[collection].find(
+            {"user_id": user_id, "$text": {"$search": q}},
+            {"_id": 0, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(window)
+        async for doc in cursor:
+            created_at = doc['created_at']
+            if isinstance(created_at, str):
+                created_at = datetime.fromisoformat(created_at)
+            results.append(SearchResult(
+                source=collection,
+                id=doc['id'],
+                text=" — ".join(doc[f] for f in fields if doc.get(f)),
+                score=doc['score'],
+                session_id=doc.get('session_id'),
+                created_at=created_at
+            ))
+
+    results.sort(key=lambda r: (r.score, r.created_at), reverse=True)
+    return SearchResponse(
+        query=q,
+        results=results[offset:offset + limit],
+        offset=offset,
+        limit=limit,
+        has_more=len(results) > offset + limit
+    )
+
+# Export routes
+# (collection, field holding the user id)
+EXPORT_COLLECTIONS = [
+    ("users", "id"),
+    ("onboarding_profiles", "user_id"),
+    ("tasks", "user_id"),
+    ("routines", "user_id"),
+    ("bills", "user_id"),
+    ("energy_checkins", "user_id"),
+    ("chat_messages", "user_id"),
+    ("weekly_resets", "user_id"),
+    ("morning_checkins", "user_id"),
+    ("tasks_archive", "user_id"),
+    ("chat_messages_archive", "user_id"),
+    ("chat_sessions_archive", "user_id"),
+]
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+@api_router.get("/export/{user_id}")
+async def export_user_data(user_id: str, compress: bool = False):
+    """
+    Streams every record belonging to the user as newline-delimited JSON,
+    one {"collection": ..., "record": ...} object per line.
+    """
+    await chat_writes.flush()
+
+    async def ndjson_chunks():
+        buffer = []
+        size = 0
+        for collection, key in EXPORT_COLLECTIONS:
+            cursor = db[collection].find({key: user_id}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+            async for doc in cursor:
+                records = [(collection, doc)]
+                if collection == "chat_sessions_archive":
+                    # Expand compressed session blobs back into individual messages
+                    if zstandard is None:
+                        continue
+                    messages = json.loads(zstandard.ZstdDecompressor().decompress(doc['data']))
+                    records = [("chat_messages_archive", msg) for msg in messages]
+                for name, record in records:
+                    line = json.dumps({"collection": name, "record": record}, default=json_default).encode() + b"\n"
+                    buffer.append(line)
+                    size += len(line)
+                if size >= EXPORT_CHUNK_BYTES:
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+
+    async def gzip_chunks():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        async for chunk in ndjson_chunks():
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    if compress:
+        return StreamingResponse(
+            gzip_chunks(),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="attic-mind-export.ndjson.gz"'}
+        )
+    return StreamingResponse(
+        ndjson_chunks(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="attic-mind-export.ndjson"'}
+    )
+
+# Import routes
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_ERRORS = 1000
+# Accepted values of the `type` column/field, mapped to (collection, create model, stored model)
+IMPORT_KINDS = {
+    "task": ("tasks", TaskCreate, Task),
+    "tasks": ("tasks", TaskCreate, Task),
+    "bill": ("bills", BillCreate, Bill),
+    "bills": ("bills", BillCreate, Bill),
+}
+
+def validation_messages(e: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+
+async def iter_body_lines(request: Request):
+    # Lines stay bytes so a bad encoding is reported against its own row
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+@api_router.post("/import/{user_id}", response_model=ImportReport)
+async def import_records(
+    user_id: str,
+    request: Request,
+    kind: str = Query("tasks", pattern="^(tasks?|bills?)$"),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+):
+    """
+    Imports tasks and bills from a CSV (header row first) or NDJSON body,
+    parsed line by line as it arrives. Rows default to `kind` unless they
+    carry a `type` of task or bill. Quoted CSV fields can't span lines.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    report = ImportReport(rows=0, imported={"tasks": 0, "bills": 0}, errors=[])
+    batches: Dict[str, List[Tuple[int, dict]]] = {"tasks": [], "bills": []}
+
+    def add_error(row: int, messages: List[str]):
+        if len(report.errors) < IMPORT_MAX_ERRORS:
+            report.errors.append(ImportRowError(row=row, errors=messages))
+        else:
+            report.errors_truncated = True
+
+    async def flush(collection: str):
+        batch = batches[collection]
+        if not batch:
+            return
+        batches[collection] = []
+        docs = [doc for _, doc in batch]
+        try:
+            await db[collection].insert_many(docs, ordered=False)
+            inserted = len(docs)
+        except BulkWriteError as e:
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            for error in e.details.get('writeErrors', []):
+                add_error(batch[error['index']][0], [error.get('errmsg', 'Could not save this row.')])
+            docs = [doc for i, doc in enumerate(docs) if i not in failed]
+            inserted = len(docs)
+        single_flight.invalidate(collection)
+        for doc in docs:
+            if collection == "tasks":
+                task_duplicates.sync(doc)
+            change_hub.publish(collection, "upsert", doc)
+        report.imported[collection] += inserted
+
+    header = None
+    line_number = 0
+    async for raw_line in iter_body_lines(request):
+        line_number += 1
+        try:
+            line = raw_line.decode("utf-8")
+        except UnicodeDecodeError:
+            if format == "csv" and header is None:
+                raise HTTPException(
+                    status_code=422,
+                    detail="This file isn't UTF-8 text. Save it as CSV UTF-8 and try again."
+                )
+            report.rows += 1
+            add_error(line_number, ["This row isn't UTF-8 text. Save the file as UTF-8 and try again."])
+            continue
+        if line_number == 1:
+            line = line.lstrip("\ufeff")
+        if not line.strip():
+            continue
+        if format == "csv" and header is None:
+            header = [column.strip() for column in next(csv.reader([line]))]
+            continue
+
+        report.rows += 1
+        try:
+            if format == "csv":
+                values = next(csv.reader([line]))
+                data = {column: value for column, value in zip(header, values) if value.strip()}
+            else:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError("Each line must be a JSON object.")
+        except (ValueError, csv.Error) as e:
+            add_error(line_number, [f"Could not read this row: {str(e)}"])
+            continue
+
+        row_kind = str(data.pop("type", kind)).strip().lower()
+        if row_kind not in IMPORT_KINDS:
+            add_error(line_number, [f"Unknown type '{row_kind}'."])
+            continue
+        collection, create_model, stored_model = IMPORT_KINDS[row_kind]
+        data["user_id"] = user_id
+        try:
+            item = create_model(**data)
+        except ValidationError as e:
+            add_error(line_number, validation_messages(e))
+            continue
+
+        doc = stored_model(**item.model_dump()).model_dump()
+        if collection == "bills":
+            doc['due_date'] = parse_calendar_date(doc['due_date'])
+        batches[collection].append((line_number, doc))
+        if len(batches[collection]) >= IMPORT_BATCH_SIZE:
+            await flush(collection)
+
+    for collection in batches:
+        await flush(collection)
+    return report
+
+# Batch routes
+# (create model, update model, stored model) per collection; updates are
+# validated with the same models as the single-document PATCH routes
+BATCH_MODELS = {
+    "tasks": (TaskCreate, TaskUpdate, Task),
+    "bills": (BillCreate, BillCreate, Bill),
+    "routines": (RoutineCreate, RoutineCreate, Routine),
+}
+
+def batch_create_doc(collection: str, user_id: str, data: dict) -> dict:
+    create_model, _, stored_model = BATCH_MODELS[collection]
+    item = create_model(**{**data, "user_id": user_id})
+    doc = stored_model(**item.model_dump()).model_dump()
+    if collection == "bills":
+        doc['due_date'] = parse_calendar_date(doc['due_date'])
+    return doc
+
+def batch_update_fields(collection: str, user_id: str, data: dict) -> dict:
+    if collection == "tasks":
+        return task_update_fields(TaskUpdate(**data))
+    _, update_model, _ = BATCH_MODELS[collection]
+    update_data = update_model(**{**data, "user_id": user_id}).model_dump()
+    if collection == "bills":
+        update_data['due_date'] = parse_calendar_date(update_data['due_date'])
+    return update_data
+
+async def run_batch_collection(user_id: str, collection: str, operations: List[Tuple[int, BatchOperation]], results: List[BatchOperationResult], session):
+    targets = [operation.id for _, operation in operations if operation.op != "create" and operation.id]
+    known = {}
+    if targets:
+        async for doc in db[collection].find({"user_id": user_id, "id": {"$in": targets}}, {"_id": 0}, session=session):
+            known[doc['id']] = doc
+    present = set(known)
+
+    requests, planned = [], []
+    for index, operation in operations:
+        result = results[index]
+        try:
+            if operation.op == "create":
+                doc = batch_create_doc(collection, user_id, operation.data)
+                known[doc['id']] = doc
+                present.add(doc['id'])
+                result.id = doc['id']
+                requests.append(InsertOne(doc))
+            elif not operation.id:
+                result.error = "id is required."
+                continue
+            elif operation.id not in present:
+                result.error = "Not found."
+                continue
+            elif operation.op == "update":
+                result.id = operation.id
+                update_data = batch_update_fields(collection, user_id, operation.data)
+                if not update_data:
+                    result.ok = True
+                    continue
+                requests.append(UpdateOne({"id": operation.id, "user_id": user_id}, {"$set": update_data}))
+            else:
+                result.id = operation.id
+                present.discard(operation.id)
+                requests.append(DeleteOne({"id": operation.id, "user_id": user_id}))
+        except ValidationError as e:
+            result.error = "; ".join(validation_messages(e))
+            continue
+        except ValueError as e:
+            result.error = str(e)
+            continue
+        planned.append(index)
+
+    if not requests:
+        return
+    # Ordered, so later operations on a document see the earlier ones
+    succeeded = len(requests)
+    try:
+        await db[collection].bulk_write(requests, ordered=True, session=session)
+    except BulkWriteError as e:
+        error = e.details['writeErrors'][0]
+        succeeded = error['index']
+        results[planned[succeeded]].error = error.get('errmsg', 'Could not save this change.')
+        for index in planned[succeeded + 1:]:
+            results[index].error = "Not applied; an earlier operation in this collection failed."
+    for index in planned[:succeeded]:
+        results[index].ok = True
+
+    single_flight.invalidate(collection)
+    changed = {results[index].id for index, _ in operations if results[index].ok}
+    current = {}
+    if changed:
+        async for doc in db[collection].find({"user_id": user_id, "id": {"$in": list(changed)}}, {"_id": 0}, session=session):
+            current[doc['id']] = doc
+    for doc_id in changed:
+        if doc_id in current:
+            if collection == "tasks":
+                task_duplicates.sync(current[doc_id])
+            change_hub.publish(collection, "upsert", current[doc_id])
+        else:
+            if collection == "tasks":
+                task_duplicates.remove(doc_id)
+            change_hub.publish(collection, "delete", known[doc_id])
+
+@api_router.post("/batch", response_model=BatchResponse)
+async def run_batch(batch: BatchRequest, response: Response):
+    """
+    Applies an ordered list of create/update/delete operations to the user's
+    tasks, bills and routines, with one ordered bulk_write per collection.
+    Invalid operations and unknown ids fail on their own; the rest still run.
+    """
+    results = [BatchOperationResult(index=i) for i in range(len(batch.operations))]
+    by_collection: Dict[str, List[Tuple[int, BatchOperation]]] = defaultdict(list)
+    for index, operation in enumerate(batch.operations):
+        by_collection[operation.collection].append((index, operation))
+
+    async with await causal_session() as session:
+        for collection, operations in by_collection.items():
+            await run_batch_collection(batch.user_id, collection, operations, results, session)
+        set_causal_token(response, session)
+    return BatchResponse(results=results)
+
+# Archival
+# Completed tasks and idle chat sessions are moved out of the hot collections
+# into *_archive collections; list routes can read them back on request.
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'false').lower() == 'true'
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+ARCHIVE_TASK_AGE_DAYS = int(os.environ.get('ARCHIVE_TASK_AGE_DAYS', '30'))
+ARCHIVE_CHAT_IDLE_DAYS = int(os.environ.get('ARCHIVE_CHAT_IDLE_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_COMPRESS_CHAT = os.environ.get('ARCHIVE_COMPRESSION', 'none').lower() == 'zstd'
+DUPLICATE_KEY_ERROR = 11000
+
+async def insert_archived(collection: str, docs: List[dict]):
+    # Archived docs keep their _id, so re-running after a partial failure is harmless
+    try:
+        await db[collection].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details.get('writeErrors', [])):
+            raise
+
+async def archive_completed_tasks() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_TASK_AGE_DAYS)
+    query = {
+        "completed": True,
+        "$or": [
+            date_condition("completed_at", {"$lt": cutoff}),
+            # Tasks completed before completed_at was recorded
+            {"completed_at": None, **date_condition("created_at", {"$lt": cutoff})},
+        ],
+    }
+    archived = 0
+    while True:
+        docs = await db.tasks.find(query).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not docs:
+            break
+        await insert_archived("tasks_archive", docs)
+        await db.tasks.delete_many({"_id": {"$in": [doc['_id'] for doc in docs]}})
+        single_flight.invalidate("tasks")
+        for doc in docs:
+            task_duplicates.remove(doc['id'])
+            change_hub.publish("tasks", "delete", doc)
+        archived += len(docs)
+    return archived
+
+async def archive_idle_chat_sessions() -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_CHAT_IDLE_DAYS)
+    await chat_writes.flush()
+    # Only sessions with a message older than the cutoff can be idle; the
+    # lookup then drops those that also have a newer one. Both stages use
+    # indexes, so a run doesn't scan the whole collection.
+    sessions = await db.chat_messages.aggregate([
+        {"$match": date_condition("created_at", {"$lt": cutoff})},
+        {"$group": {"_id": {"user_id": "$user_id", "session_id": "$session_id"}}},
+        {"$lookup": {
+            "from": "chat_messages",
+            "let": {"user_id": "$_id.user_id", "session_id": "$_id.session_id"},
+            "pipeline": [
+                {"$match": {
+                    "$expr": {"$and": [
+                        {"$eq": ["$user_id", "$$user_id"]},
+                        {"$eq": ["$session_id", "$$session_id"]},
+                    ]},
+                    **date_condition("created_at", {"$gte": cutoff}),
+                }},
+                {"$limit": 1},
+                {"$project": {"_id": 1}},
+            ],
+            "as": "recent",
+        }},
+        {"$match": {"recent": []}},
+        {"$limit": ARCHIVE_BATCH_SIZE},
+    ]).to_list(ARCHIVE_BATCH_SIZE)
+
+    for session in sessions:
+        session_query = {"user_id": session['_id']['user_id'], "session_id": session['_id']['session_id']}
+        messages = await find_chronological(db.chat_messages, session_query, None, "created_at", 1, None)
+        if not messages:
+            continue
+        if ARCHIVE_COMPRESS_CHAT and zstandard is not None:
+            payload = json.dumps(
+                [{k: v for k, v in msg.items() if k != '_id'} for msg in messages],
+                default=json_default
+            ).encode()
+            await insert_archived("chat_sessions_archive", [{
+                "_id": f"{session_query['user_id']}:{session_query['session_id']}:{messages[0]['id']}",
+                **session_query,
+                "message_count": len(messages),
+                "first_message_at": messages[0]['created_at'],
+                "last_message_at": messages[-1]['created_at'],
+                "codec": "zstd",
+                "data": Binary(zstandard.ZstdCompressor(level=10).compress(payload)),
+            }])
+        else:
+            await insert_archived("chat_messages_archive", messages)
+        await db.chat_messages.delete_many({"_id": {"$in": [msg['_id'] for msg in messages]}})
+    return len(sessions)
+
+async def load_archived_chat(user_id: str, session_id: str) -> List[dict]:
+    query = {"user_id": user_id, "session_id": session_id}
+    messages = []
+    blobs = db.chat_sessions_archive.find(query).sort("first_message_at", 1)
+    async for blob in blobs:
+        if zstandard is None:
+            logging.warning("zstandard is not installed; skipping compressed chat archive")
+            break
+        messages += json.loads(zstandard.ZstdDecompressor().decompress(blob['data']))
+    messages += await db.chat_messages_archive.find(query, {"_id": 0}).sort("created_at", 1).to_list(None)
+    for msg in messages:
+        if isinstance(msg['created_at'], str):
+            msg['created_at'] = datetime.fromisoformat(msg['created_at'])
+    messages.sort(key=lambda msg: msg['created_at'])
+    return messages
+
+async def run_archiver():
+    while True:
+        try:
+            tasks_archived = await archive_completed_tasks()
+            sessions_archived = await archive_idle_chat_sessions()
+            if tasks_archived or sessions_archived:
+                logger.info(f"Archived {tasks_archived} tasks and {sessions_archived} chat sessions")
+        except Exception as e:
+            logging.error(f"Archiver error: {str(e)}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+archiver_task: Optional[asyncio.Task] = None
+
+# Live change routes
+@api_router.websocket("/ws/{user_id}")
+async def live_changes(websocket: WebSocket, user_id: str):
+    """
+    Pushes {"collection", "op": "upsert"|"delete", "id", "document"} events for
+    the user's tasks, bills and routines. {"op": "resync"} asks the client to
+    refetch; {"op": "ping"} keeps idle proxies from closing the socket.
+    """
+    await websocket.accept()
+    queue = change_hub.subscribe(user_id)
+
+    async def pump():
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=LIVE_PING_SECONDS)
+            except asyncio.TimeoutError:
+                event = {"op": "ping"}
+            await websocket.send_json(event)
+
+    async def drain():
+        # Clients don't send anything; receiving only notices the close
+        while True:
+            await websocket.receive_text()
+
+    # Whichever side ends first (peer close, failed send) ends the other
+    sender = asyncio.create_task(pump())
+    receiver = asyncio.create_task(drain())
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        change_hub.unsubscribe(user_id, queue)
+        sender.cancel()
+        receiver.cancel()
+        results = await asyncio.gather(sender, receiver, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, WebSocketDisconnect):
+            logging.warning(f"Live socket for {user_id} closed on error: {str(result) or type(result).__name__}")
+
+@api_router.get("/live/stats")
+async def get_live_stats():
+    return {
+        "source": "change_stream" if change_hub.watching else "in_process",
+        "sockets": change_hub.socket_count,
+        **change_hub.stats,
+    }
+
+# Health routes
+@api_router.get("/health/ready")
+async def readiness():
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=MONGO_READY_TIMEOUT_MS / 1000)
+    except Exception as e:
+        logging.warning(f"Readiness check failed: {str(e) or type(e).__name__}")
+        return JSONResponse(status_code=503, content={"status": "unavailable", "mongo": type(e).__name__})
+    return {"status": "ready", "mongo_ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+@api_router.get("/health/pool")
+async def get_pool_stats():
+    return {
+        "options": {
+            "maxPoolSize": client.options.pool_options.max_pool_size,
+            "minPoolSize": client.options.pool_options.min_pool_size,
+            "maxIdleTimeMS": client.options.pool_options.max_idle_time_seconds * 1000
+            if client.options.pool_options.max_idle_time_seconds is not None else None,
+            "waitQueueTimeoutMS": client.options.pool_options.wait_queue_timeout * 1000
+            if client.options.pool_options.wait_queue_timeout is not None else None,
+            "serverSelectionTimeoutMS": client.options.server_selection_timeout * 1000,
+        },
+        "servers": pool_stats.snapshot(),
+    }
+
+# Execution lanes
+# Slow LLM routes and fast CRUD routes get separate concurrency budgets and
+# queues, so a burst of chat/offload traffic waits in its own lane instead of
+# crowding out everything else. Streaming exports and imports hold their slot
+# for the whole body, so they get a small lane of their own. Health probes
+# skip the lanes so a full lane can't fail readiness.
+LLM_ROUTE_PATHS = {"/api/chat", "/api/brain-offload", "/api/brain-offload/stream"}
+BULK_ROUTE_PREFIXES = ("/api/export/", "/api/import/")
+UNSCHEDULED_ROUTE_PREFIXES = ("/api/health/",)
+
+class LaneFull(Exception):
+    pass
+
+class ExecutionLane:
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.active + self.waiting >= self.concurrency + self.max_queue:
+            self.stats["rejected"] += 1
+            raise LaneFull(self.name)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["timed_out"] += 1
+            raise LaneFull(self.name)
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            **self.stats,
+        }
+
+def lane_from_env(name: str, concurrency: int, max_queue: int, queue_timeout: float) -> ExecutionLane:
+    prefix = f"LANE_{name.upper()}_"
+    return ExecutionLane(
+        name,
+        concurrency=int(os.environ.get(prefix + 'CONCURRENCY', str(concurrency))),
+        max_queue=int(os.environ.get(prefix + 'QUEUE', str(max_queue))),
+        queue_timeout=float(os.environ.get(prefix + 'QUEUE_TIMEOUT_SECONDS', str(queue_timeout)))
+    )
+
+lanes = {
+    "llm": lane_from_env("llm", concurrency=8, max_queue=32, queue_timeout=30),
+    "crud": lane_from_env("crud", concurrency=64, max_queue=256, queue_timeout=5),
+    "bulk": lane_from_env("bulk", concurrency=4, max_queue=16, queue_timeout=10),
+}
+
+def route_lane(request: Request) -> str:
+    if request.method == "POST" and request.url.path in LLM_ROUTE_PATHS:
+        return "llm"
+    if request.url.path.startswith(BULK_ROUTE_PREFIXES):
+        return "bulk"
+    return "crud"
+
+@api_router.get("/lanes")
+async def get_lanes():
+    return {name: lane.snapshot() for name, lane in lanes.items()}
+
+# Request profiling
+# An admin (anyone sending X-Admin-Token matching ADMIN_TOKEN; with no token
+# configured the admin routes are closed) can profile one request by sending
+# X-Profile: 1, and PROFILE_SAMPLE_RATE profiles a random share of all
+# requests. Sampling covers the handler, up to the response being returned;
+# a streamed body's generation after that isn't sampled. A sampler
+# thread snapshots the event loop thread's stack; samples taken while another
+# request's task is running, or while this one is awaiting I/O, are recorded
+# as "(awaiting)". Tasks are matched to a profile by a task factory that tags
+# every task created inside a profiled request. The speedscope profile is stored in request_profiles with
+# the route, user, and every Mongo command and LLM call the request made.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_SAMPLES = 20000
+PROFILE_TTL_DAYS = int(os.environ.get('PROFILE_TTL_DAYS', '7'))
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+def is_admin(request) -> bool:
+    # Only the token counts: behind the ingress proxy every peer is loopback
+    token = request.headers.get("x-admin-token")
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+class RequestProfile:
+    def __init__(self, interval_ms: float):
+        self.id = str(uuid.uuid4())
+        self.interval = interval_ms / 1000
+        self.frames: List[dict] = []
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self.timings: Dict[str, List[dict]] = {"mongo": [], "llm": []}
+        self._frame_index: Dict[tuple, int] = {}
+        self._timings_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.duration_ms = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"profile-{self.id}", daemon=True)
+        self._thread.start()
+
+    def add_timing(self, kind: str, details: dict):
+        with self._timings_lock:
+            self.timings[kind].append({
+                "at_ms": (time.perf_counter() - self._started) * 1000,
+                **details,
+            })
+
+    def stop(self):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self._stopped.set()
+        self._thread.join()
+
+    def _frame(self, key: tuple) -> int:
+        index = self._frame_index.get(key)
+        if index is None:
+            name, file, line = key
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({"name": name, "file": file, "line": line} if file else {"name": name})
+        return index
+
+    def _stack(self) -> List[int]:
+        task = asyncio.current_task(self._loop)
+        frame = sys._current_frames().get(self._loop_thread)
+        if task is None or frame is None or _profiled_tasks.get(task) is not self:
+            return [self._frame(("(awaiting)", None, None))]
+        keys = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename.startswith(_ASYNCIO_DIR):
+                break  # everything below is the event loop itself
+            keys.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return [self._frame(key) for key in reversed(keys)]
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval) and len(self.samples) < PROFILE_MAX_SAMPLES:
+            now = time.perf_counter()
+            self.samples.append(self._stack())
+            self.weights.append((now - last) * 1000)
+            last = now
+
+    def speedscope(self, name: str) -> dict:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "mindattic-server",
+            "activeProfileIndex": 0,
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": self.duration_ms,
+                "samples": self.samples,
+                "weights": self.weights,
+            }],
+        }
+
+    def document(self, request: Request, status_code: int) -> dict:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", request.url.path)
+        with self._timings_lock:
+            timings = {kind: list(entries) for kind, entries in self.timings.items()}
+        return {
+            "_id": self.id,
+            "method": request.method,
+            "route": route_path,
+            "path": request.url.path,
+            "user_id": request.scope.get("path_params", {}).get("user_id") or request.query_params.get("user_id"),
+            "status_code": status_code,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "mongo_ms": sum(entry["duration_ms"] for entry in timings["mongo"]),
+            "llm_ms": sum(entry["duration_ms"] for entry in timings["llm"]),
+            "timings": timings,
+            "sample_count": len(self.samples),
+            "speedscope": self.speedscope(f"{request.method} {route_path}"),
+        }
+
+_profile_saves = set()
+
+async def save_profile(doc: dict):
+    try:
+        await db.request_profiles.insert_one(doc)
+    except Exception as e:
+        logging.error(f"Could not save request profile {doc['_id']}: {str(e)}")
+
+_profiled_tasks: "weakref.WeakKeyDictionary[asyncio.Task, RequestProfile]" = weakref.WeakKeyDictionary()
+
+def install_profiling_task_factory(loop: asyncio.AbstractEventLoop):
+    previous = loop.get_task_factory()
+    if getattr(previous, "tags_profiled_tasks", False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        profile = active_profile.get()
+        if profile is not None:
+            _profiled_tasks[task] = profile
+        return task
+
+    factory.tags_profiled_tasks = True
+    loop.set_task_factory(factory)
+
+def should_profile(request: Request) -> bool:
+    if request.headers.get(PROFILE_HEADER) == "1" and is_admin(request):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+@api_router.get("/admin/profiles")
+async def list_profiles(
+    request: Request,
+    route: Optional[str] = None,
+    user_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+):
+    require_admin(request)
+    query = {}
+    if route:
+        query["route"] = route
+    if user_id:
+        query["user_id"] = user_id
+    return await db.request_profiles.find(
+        query, {"speedscope": 0, "timings": 0}
+    ).sort("started_at", -1).limit(limit).to_list(limit)
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str, format: Optional[str] = Query(None, pattern="^speedscope$")):
+    """
+    Returns the stored profile; with ?format=speedscope, just the file to
+    open in https://www.speedscope.app
+    """
+    require_admin(request)
+    profile = await db.request_profiles.find_one({"_id": profile_id})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "speedscope":
+        return JSONResponse(
+            profile["speedscope"],
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.speedscope.json"'}
+        )
+    return profile
+
+# Slow command routes
+SLOW_COMMAND_FLUSH_SECONDS = 1
+_last_explained: Dict[str, float] = {}
+
+def summarize_explain(explain: dict) -> dict:
+    # find/count/distinct put queryPlanner at the top; aggregate nests it in a $cursor stage
+    def find_key(node, key):
+        if isinstance(node, dict):
+            if key in node:
+                return node[key]
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            return None
+        for child in children:
+            found = find_key(child, key)
+            if found is not None:
+                return found
+        return None
+
+    plan = find_key(explain, "winningPlan") or {}
+    stats = find_key(explain, "executionStats") or {}
+    stages, indexes = [], []
+    while isinstance(plan, dict) and plan:
+        stages.append(plan.get("stage"))
+        if plan.get("indexName"):
+            indexes.append(plan["indexName"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return {
+        "stages": [stage for stage in stages if stage],
+        "indexes": indexes,
+        "collection_scan": "COLLSCAN" in stages,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+    }
+
+async def explain_slow_command(entry: dict, command: dict) -> Optional[dict]:
+    now = time.monotonic()
+    if now - _last_explained.get(entry["shape_key"], float("-inf")) < SLOW_COMMAND_EXPLAIN_INTERVAL_SECONDS:
+        return None
+    if entry["command"] == "aggregate" and any(
+        "$out" in stage or "$merge" in stage for stage in command.get("pipeline", [])
+    ):
+        return None
+    _last_explained[entry["shape_key"]] = now
+    # Session, cluster time and similar fields belong to the original call only
+    original = {
+        key: value for key, value in command.items()
+        if not key.startswith("$") and key not in ("lsid", "txnNumber", "readConcern")
+    }
+    try:
+        explain = await client[entry["database"]].command({"explain": original, "verbosity": "executionStats"})
+    except PyMongoError as e:
+        return {"error": str(e)}
+    return summarize_explain(explain)
+
+async def run_slow_command_writer():
+    while True:
+        await asyncio.sleep(SLOW_COMMAND_FLUSH_SECONDS)
+        entries = []
+        while slow_commands.pending:
+            entries.append(slow_commands.pending.popleft())
+        if not entries:
+            continue
+        try:
+            for entry in entries:
+                command = entry.pop("_explain_command", None)
+                if command is not None:
+                    explain = await explain_slow_command(entry, command)
+                    if explain is not None:
+                        entry["explain"] = explain
+            await db[SLOW_COMMAND_COLLECTION].insert_many(entries, ordered=False)
+        except Exception as e:
+            logging.error(f"Slow command log error: {str(e)}")
+
+slow_command_writer_task: Optional[asyncio.Task] = None
+
+@api_router.get("/admin/slow-commands")
+async def get_slow_command_shapes(
+    request: Request,
+    since_minutes: int = Query(60 * 24, ge=1),
+    collection: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+):
+    """
+    Ranks query shapes from the slow command log by total time spent, with
+    counts, average/max duration and the latest explain summary.
+    """
+    require_admin(request)
+    match = {"at": {"$gte": datetime.now(timezone.utc) - timedelta(minutes=since_minutes)}}
+    if collection:
+        match["collection"] = collection
+    return await db[SLOW_COMMAND_COLLECTION].aggregate([
+        {"$match": match},
+        {"$sort": {"at": 1}},
+        {"$group": {
+            "_id": {"collection": "$collection", "command": "$command", "shape_key": "$shape_key"},
+            "shape": {"$last": "$shape"},
+            "count": {"$sum": 1},
+            "total_ms": {"$sum": "$duration_ms"},
+            "avg_ms": {"$avg": "$duration_ms"},
+            "max_ms": {"$max": "$duration_ms"},
+            "failures": {"$sum": {"$cond": ["$ok", 0, 1]}},
+            "last_seen": {"$last": "$at"},
+            "explain": {"$last": "$explain"},
+        }},
+        {"$sort": {"total_ms": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "collection": "$_id.collection",
+            "command": "$_id.command",
+            "shape": 1,
+            "count": 1,
+            "total_ms": 1,
+            "avg_ms": 1,
+            "max_ms": 1,
+            "failures": 1,
+            "last_seen": 1,
+            "explain": 1,
+        }},
+    ]).to_list(limit)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Response format negotiation
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+
+def accepted_encodings(header: str) -> set:
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            encodings.add(name.strip().lower())
+    return encodings
+
+@app.middleware("http")
+async def negotiate_response_format(request: Request, call_next):
+    """
+    Re-encodes JSON responses as MessagePack when the client sends
+    `Accept: application/msgpack`, and compresses bodies above
+    COMPRESSION_MIN_BYTES with brotli or gzip per Accept-Encoding.
+    Streaming and already-encoded responses pass through untouched.
+    """
+    response = await call_next(request)
+    if (
+        not response.headers.get("content-type", "").startswith("application/json")
+        or "content-encoding" in response.headers
+    ):
+        return response
+
+    wants_msgpack = msgpack is not None and "application/msgpack" in request.headers.get("accept", "")
+    encodings = accepted_encodings(request.headers.get("accept-encoding", ""))
+    encoding = "br" if brotli is not None and "br" in encodings else "gzip" if "gzip" in encodings else None
+    if not wants_msgpack and encoding is None:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    media_type = "application/json"
+    if wants_msgpack and body:
+        body = msgpack.packb(json.loads(body), use_bin_type=True)
+        media_type = "application/msgpack"
+    headers = {
+        k: v for k, v in response.headers.items()
+        if k.lower() not in ("content-length", "content-type")
+    }
+    headers["vary"] = "Accept, Accept-Encoding"
+    if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+        body = brotli.compress(body, quality=5) if encoding == "br" else gzip.compress(body, compresslevel=6)
+        headers["content-encoding"] = encoding
+    return Response(body, status_code=response.status_code, headers=headers, media_type=media_type)
+
+@app.middleware("http")
+async def schedule_in_lane(request: Request, call_next):
+    if request.url.path.startswith(UNSCHEDULED_ROUTE_PREFIXES):
+        return await call_next(request)
+    lane = lanes[route_lane(request)]
+    slot = AsyncExitStack()
+    try:
+        await slot.enter_async_context(lane.slot())
+        remaining = remaining_seconds()
+        if remaining is not None and remaining <= 0:
+            # Expired while queued; don't start work nobody is waiting for
+            raise LaneFull(lane.name)
+    except LaneFull:
+        await slot.aclose()
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "We're a little busy right now. Please try again in a moment."},
+            headers={"Retry-After": "1"}
+        )
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await slot.aclose()
+        raise
+    # Streamed replies keep generating after call_next returns, so the slot
+    # is held until the last chunk has been sent
+    response.body_iterator = release_after_body(response.body_iterator, slot)
+    return response
+
+async def release_after_body(body_iterator, slot: AsyncExitStack):
+    async with slot:
+        async for chunk in body_iterator:
+            yield chunk
+
+@app.middleware("http")
+async def apply_deadline(request: Request, call_next):
+    budget_ms = None
+    if not request.url.path.startswith(UNBOUNDED_ROUTE_PREFIXES):
+        budget_ms = DEADLINES_MS.get(route_lane(request))
+    try:
+        budget_ms = min(max(int(request.headers[REQUEST_TIMEOUT_HEADER]), 1), DEADLINE_MAX_MS)
+    except (KeyError, ValueError):
+        pass
+    if budget_ms is None:
+        return await call_next(request)
+
+    token = request_deadline.set(time.monotonic() + budget_ms / 1000)
+    try:
+        with pymongo.timeout(budget_ms / 1000):
+            return await call_next(request)
+    finally:
+        request_deadline.reset(token)
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    if not should_profile(request):
+        return await call_next(request)
+
+    install_profiling_task_factory(asyncio.get_running_loop())
+    profile = RequestProfile(PROFILE_INTERVAL_MS)
+    token = active_profile.set(profile)
+    request_task = asyncio.current_task()
+    _profiled_tasks[request_task] = profile
+    try:
+        response = await call_next(request)
+    finally:
+        active_profile.reset(token)
+        _profiled_tasks.pop(request_task, None)
+        # Stopped here rather than after the body, which may never be sent
+        # (HEAD, early disconnect); joining the sampler blocks, so off the loop
+        await asyncio.to_thread(profile.stop)
+    response.headers[PROFILE_ID_HEADER] = profile.id
+    task = asyncio.create_task(save_profile(profile.document(request, response.status_code)))
+    _profile_saves.add(task)
+    task.add_done_callback(_profile_saves.discard)
+    return response
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    if not TRACING_ENABLED:
+        return await call_next(request)
+    match = _TRACEPARENT_RE.match(request.headers.get(TRACEPARENT_HEADER, ""))
+    if match and match.group(1) != "0" * 32 and match.group(2) != "0" * 16:
+        trace_id, parent_id = match.group(1), match.group(2)
+        sampled = int(match.group(3), 16) & 1 == 1
+    else:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    if not sampled:
+        return await call_next(request)
+
+    span = Span(f"{request.method} {request.url.path}", SPAN_KIND_SERVER, trace_id, parent_id, {
+        "http.request.method": request.method,
+        "url.path": request.url.path,
+        "user_agent.original": request.headers.get("user-agent"),
+    })
+    token = current_span.set(span)
+    try:
+        response = await call_next(request)
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        span.end()
+        raise
+    finally:
+        current_span.reset(token)
+    route = request.scope.get("route")
+    if route is not None:
+        # Name by template so /api/tasks/{task_id} groups across ids
+        span.name = f"{request.method} {route.path}"
+        span.attributes["http.route"] = route.path
+    span.attributes["http.response.status_code"] = response.status_code
+    if response.status_code >= 500:
+        span.error = f"HTTP {response.status_code}"
+    response.headers[TRACEPARENT_HEADER] = span.traceparent
+
+    async def end_after_body(body_iterator):
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            span.end()
+
+    response.body_iterator = end_after_body(response.body_iterator)
+    return response
+
+@app.exception_handler(PyMongoError)
+async def handle_mongo_error(request: Request, exc: PyMongoError):
+    if exc.timeout:
+        return JSONResponse(
+            status_code=504,
+            content={"detail": "This is taking longer than usual. Please try again in a moment."}
+        )
+    logging.error(f"Database error on {request.url.path}: {str(exc)}")
+    return JSONResponse(status_code=500, content={"detail": "Something went wrong on our side."})
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CAUSAL_TOKEN_HEADER, IDEMPOTENCY_REPLAY_HEADER, PROFILE_ID_HEADER, TRACEPARENT_HEADER],
 )
 
 # Configure logging
+logging.setLogRecordFactory(trace_log_record_factory)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - trace_id=%(trace_id)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Index setup
+# Runs in the background so a worker boots (and /api/health/ready can answer
+# 503) while Mongo is unreachable; failed steps are retried until they pass.
+INDEX_RETRY_SECONDS = int(os.environ.get('INDEX_RETRY_SECONDS', '30'))
+index_setup_task: Optional[asyncio.Task] = None
+
+async def create_core_indexes():
+    for collection, fields in SEARCHABLE_COLLECTIONS.items():
+        await db[collection].create_index(
+            [("user_id", 1)] + [(field, "text") for field in fields],
+            name=f"{collection}_search"
+        )
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+    await db.request_profiles.create_index("started_at", expireAfterSeconds=PROFILE_TTL_DAYS * 86400)
+    await db.request_profiles.create_index([("route", 1), ("started_at", -1)])
+
+async def create_archive_indexes():
+    await db.tasks_archive.create_index([("user_id", 1), ("category", 1)])
+    await db.chat_messages.create_index([("created_at", 1)])
+    await db.chat_messages.create_index([("user_id", 1), ("session_id", 1), ("created_at", 1)])
+    await db.chat_messages_archive.create_index([("user_id", 1), ("session_id", 1), ("created_at", 1)])
+    await db.chat_sessions_archive.create_index([("user_id", 1), ("session_id", 1), ("first_message_at", 1)])
+
+async def create_slow_command_log():
+    global slow_command_writer_task
+    try:
+        await db.create_collection(SLOW_COMMAND_COLLECTION, capped=True, size=SLOW_COMMAND_LOG_BYTES)
+    except CollectionInvalid:
+        pass
+    await db[SLOW_COMMAND_COLLECTION].create_index([("at", 1)])
+    # Started only now: an earlier insert would create the collection uncapped
+    slow_command_writer_task = asyncio.create_task(run_slow_command_writer())
+
+async def run_index_setup(steps):
+    while steps:
+        failed = []
+        for step in steps:
+            try:
+                await step()
+            except Exception as e:
+                logging.error(f"Index setup step {step.__name__} failed, retrying in {INDEX_RETRY_SECONDS}s: {str(e)}")
+                failed.append(step)
+        steps = failed
+        if steps:
+            await asyncio.sleep(INDEX_RETRY_SECONDS)
+
+@app.on_event("startup")
+async def ensure_indexes():
+    global index_setup_task
+    index_setup_task = asyncio.create_task(
+        run_index_setup([create_core_indexes, create_archive_indexes, create_slow_command_log])
+    )
+
+@app.on_event("startup")
+async def schedule_llm_warmup():
+    if not LLM_WARMUP:
+        return
+
+    async def warm():
+        # Let the server report ready before paying for the import
+        await asyncio.sleep(LLM_WARMUP_DELAY_SECONDS)
+        try:
+            await load_llm_module()
+        except Exception as e:
+            logging.error(f"LLM warmup failed: {str(e)}")
+
+    asyncio.create_task(warm())
+
+@app.on_event("startup")
+async def start_write_buffers():
+    chat_writes.start()
+
+@app.on_event("startup")
+async def start_archiver():
+    global archiver_task
+    if ARCHIVE_ENABLED:
+        if ARCHIVE_COMPRESS_CHAT and zstandard is None:
+            logger.warning("ARCHIVE_COMPRESSION=zstd but zstandard is not installed; archiving chat uncompressed")
+        archiver_task = asyncio.create_task(run_archiver())
+
+@app.on_event("startup")
+async def start_change_stream():
+    global change_stream_task
+    if CHANGE_STREAMS_ENABLED:
+        change_stream_task = asyncio.create_task(change_hub.watch())
+
+@app.on_event("startup")
+async def start_span_exporter():
+    if TRACING_ENABLED:
+        span_exporter.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if index_setup_task is not None:
+        index_setup_task.cancel()
+    if archiver_task is not None:
+        archiver_task.cancel()
+    if slow_command_writer_task is not None:
+        slow_command_writer_task.cancel()
+    span_exporter.stop()
+    if change_stream_task is not None:
+        change_stream_task.cancel()
+    await chat_writes.stop()
     client.close()
\ No newline at end of file
@@ -0,0 +1,68 @@
+import { useEffect, useRef, useState } from "react";
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const RECONNECT_MAX_MS = 30000;
+
+// Subscribes to the API's change feed for one user and hands events for
+// `collection` to onChange. onResync is called whenever events may have been
+// missed (after a reconnect, or when the server says we fell behind), so the
+// page can refetch. Returns whether the socket is currently open.
+export function useLiveChanges(userId, collection, onChange, onResync) {
+  const [connected, setConnected] = useState(false);
+  const handlers = useRef({ onChange, onResync });
+  handlers.current = { onChange, onResync };
+
+  useEffect(() => {
+    const url = `${BACKEND_URL.replace(/^http/, "ws")}/api/ws/${userId}`;
+    let socket;
+    let retryTimer;
+    let attempts = 0;
+    let stopped = false;
+
+    const connect = () => {
+      socket = new WebSocket(url);
+      socket.onopen = () => {
+        if (attempts > 0) handlers.current.onResync();
+        attempts = 0;
+        setConnected(true);
+      };
+      socket.onmessage = (message) => {
+        const event = JSON.parse(message.data);
+        if (event.op === "resync") {
+          handlers.current.onResync();
+        } else if (event.collection === collection) {
+          handlers.current.onChange(event);
+        }
+      };
+      socket.onclose = () => {
+        setConnected(false);
+        if (stopped) return;
+        attempts += 1;
+        retryTimer = setTimeout(connect, Math.min(1000 * 2 ** attempts, RECONNECT_MAX_MS));
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      socket.close();
+    };
+  }, [userId, collection]);
+
+  return connected;
+}
+
+// Applies an upsert or delete event to a list of documents with an `id`.
+export function applyChange(items, event) {
+  if (event.op === "delete") {
+    return items.filter((item) => item.id !== event.id);
+  }
+  const index = items.findIndex((item) => item.id === event.id);
+  if (index === -1) {
+    return [...items, event.document];
+  }
+  const next = [...items];
+  next[index] = event.document;
+  return next;
+}
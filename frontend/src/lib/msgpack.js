@@ -0,0 +1,23 @@
+import axios from "axios";
+import { decode } from "@msgpack/msgpack";
+
+// Ask the API for MessagePack; routes that can't provide it still answer with JSON.
+// Compression (gzip/br) is negotiated by the browser itself via Accept-Encoding.
+axios.defaults.headers.common.Accept = "application/msgpack, application/json;q=0.9";
+axios.defaults.responseType = "arraybuffer";
+axios.defaults.transformResponse = [
+  (data, headers) => {
+    if (!(data instanceof ArrayBuffer)) return data;
+    const bytes = new Uint8Array(data);
+    const contentType = String(headers?.["content-type"] || "");
+    if (contentType.includes("application/msgpack")) {
+      return decode(bytes);
+    }
+    const text = new TextDecoder().decode(bytes);
+    try {
+      return JSON.parse(text);
+    } catch {
+      return text;
+    }
+  },
+];
@@ -2,6 +2,7 @@ import { useState, useEffect } from "react";
 import axios from "axios";
 import { Plus, DollarSign, CheckCircle2, AlertCircle, Zap, Edit2, Trash2 } from "lucide-react";
 import { toast } from "sonner";
+import { useLiveChanges, applyChange } from "@/hooks/use-live-changes";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -26,6 +27,11 @@ export default function Bills() {
     fetchBills();
   }, []);
 
+  const applyBillChange = (event) => setBills((current) => applyChange(current, event));
+
+  // Changes from this tab, other tabs and other devices all arrive here
+  useLiveChanges(USER_ID, "bills", applyBillChange, () => fetchBills());
+
   const fetchBills = async () => {
     try {
       const res = await axios.get(`${API}/bills/${USER_ID}`);
@@ -70,7 +76,7 @@ export default function Bills() {
     setAmountError("");
 
     try {
-      await axios.post(`${API}/bills`, {
+      const res = await axios.post(`${API}/bills`, {
         user_id: USER_ID,
         name: newBill.name,
         amount: amount,
@@ -82,7 +88,7 @@ export default function Bills() {
       setNewBill({ name: "", amount: "", due_date: "", recurring: false, autopay: false, frequency: "Monthly" });
       setAmountError("");
       setShowAdd(false);
-      fetchBills();
+      applyBillChange({ op: "upsert", id: res.data.id, document: res.data });
       toast.success("Your bill has been added.");
     } catch (error) {
       console.error("Error adding bill:", error);
@@ -93,7 +99,7 @@ export default function Bills() {
   const payBill = async (bill) => {
     try {
       await axios.patch(`${API}/bills/${bill.id}/pay`);
-      fetchBills();
+      applyBillChange({ op: "upsert", id: bill.id, document: { ...bill, paid: true } });
       toast.success("Marked as paid. One less thing to hold.");
     } catch (error) {
       toast.error("That didn't go through. Let's try that again slowly.");
@@ -128,7 +134,7 @@ export default function Bills() {
     if (!newBill.name.trim() || !newBill.amount || !newBill.due_date) return;
 
     try {
-      await axios.patch(`${API}/bills/${editingBill}`, {
+      const res = await axios.patch(`${API}/bills/${editingBill}`, {
         user_id: USER_ID,
         name: newBill.name,
         amount: parseFloat(newBill.amount),
@@ -139,7 +145,7 @@ export default function Bills() {
       });
       setNewBill({ name: "", amount: "", due_date: "", recurring: false, autopay: false, frequency: "Monthly" });
       setEditingBill(null);
-      fetchBills();
+      applyBillChange({ op: "upsert", id: res.data.id, document: res.data });
       toast.success("Your bill has been updated.");
     } catch (error) {
       console.error("Error updating bill:", error);
@@ -150,7 +156,7 @@ export default function Bills() {
   const deleteBill = async (billId) => {
     try {
       await axios.delete(`${API}/bills/${billId}`);
-      fetchBills();
+      applyBillChange({ op: "delete", id: billId });
       toast.success("Removed. You're all set.");
     } catch (error) {
       toast.error("That didn't save this time. Try again in a moment.");
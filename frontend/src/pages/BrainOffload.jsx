@@ -13,32 +13,66 @@ export default function BrainOffload() {
   const [input, setInput] = useState("");
   const [processing, setProcessing] = useState(false);
   const [organized, setOrganized] = useState(null);
+  const [duplicates, setDuplicates] = useState({});
 
   const processOffload = async () => {
     if (!input.trim() || processing) return;
 
     setProcessing(true);
+    let received = 0;
     try {
-      // Call the brain offload API endpoint
-      const response = await axios.post(`${API}/brain-offload`, {
-        user_id: USER_ID,
-        raw_text: input,
+      // Stream sorted tasks in as the model finishes each one
+      const response = await fetch(`${API}/brain-offload/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ user_id: USER_ID, raw_text: input }),
       });
-
-      // Organize tasks by category
-      const tasksByCategory = {
-        today: [],
-        this_week: [],
-        later: [],
+      if (!response.ok || !response.body) {
+        throw new Error(`Brain offload failed with status ${response.status}`);
+      }
+
+      setDuplicates({});
+      setOrganized({ today: [], this_week: [], later: [] });
+
+      const addTask = (task) => {
+        received += 1;
+        setOrganized((current) => ({
+          ...current,
+          [task.category]: [...current[task.category], task.title],
+        }));
+        if (task.duplicate_of) {
+          setDuplicates((current) => ({ ...current, [task.title]: task.duplicate_title }));
+        }
       };
 
-      response.data.tasks.forEach(task => {
-        tasksByCategory[task.category].push(task.title);
-      });
-
-      setOrganized(tasksByCategory);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let failed = false;
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        lines.filter(Boolean).forEach((line) => {
+          const message = JSON.parse(line);
+          if (message.task) addTask(message.task);
+          if (message.error) failed = true;
+        });
+      }
+
+      if (failed) {
+        if (received === 0) {
+          setOrganized(null);
+        }
+        toast.error("Your words didn't save this time, but they're still yours. Please try again.");
+      }
     } catch (error) {
       console.error("Error processing offload:", error);
+      if (received === 0) {
+        setOrganized(null);
+      }
       toast.error("Your words didn't save this time, but they're still yours. Please try again.");
     } finally {
       setProcessing(false);
@@ -53,7 +87,7 @@ export default function BrainOffload() {
         ...organized.today.map(t => ({ title: t, category: "today" })),
         ...organized.this_week.map(t => ({ title: t, category: "this_week" })),
         ...organized.later.map(t => ({ title: t, category: "later" })),
-      ];
+      ].filter(task => !duplicates[task.title]);
 
       // Save all tasks
       await Promise.all(
@@ -122,7 +156,9 @@ export default function BrainOffload() {
           <div className="bg-white rounded-[2rem] border border-stone-100 shadow-[0_2px_20px_rgba(0,0,0,0.02)] p-6 sm:p-8">
             <h2 className="text-2xl mb-4 font-fraunces">Here's what I organized for you</h2>
             <p className="text-stone-600 leading-relaxed font-caveat text-lg mb-8">
-              I sorted everything into gentle steps. You can adjust these anytime.
+              {processing
+                ? "Still sorting — things will appear here as I go."
+                : "I sorted everything into gentle steps. You can adjust these anytime."}
             </p>
 
             {/* Today */}
@@ -136,6 +172,9 @@ export default function BrainOffload() {
                     <li key={idx} className="flex items-start gap-2 bg-stone-50 p-3 rounded-xl">
                       <span className="text-primary mt-1">•</span>
                       <span className="text-stone-700">{task}</span>
+                      {duplicates[task] && (
+                        <span className="ml-auto text-xs text-stone-400 whitespace-nowrap">Already on your list</span>
+                      )}
                     </li>
                   ))}
                 </ul>
@@ -153,6 +192,9 @@ export default function BrainOffload() {
                     <li key={idx} className="flex items-start gap-2 bg-stone-50 p-3 rounded-xl">
                       <span className="text-info mt-1">•</span>
                       <span className="text-stone-700">{task}</span>
+                      {duplicates[task] && (
+                        <span className="ml-auto text-xs text-stone-400 whitespace-nowrap">Already on your list</span>
+                      )}
                     </li>
                   ))}
                 </ul>
@@ -170,6 +212,9 @@ export default function BrainOffload() {
                     <li key={idx} className="flex items-start gap-2 bg-stone-50 p-3 rounded-xl">
                       <span className="text-muted-foreground mt-1">•</span>
                       <span className="text-stone-700">{task}</span>
+                      {duplicates[task] && (
+                        <span className="ml-auto text-xs text-stone-400 whitespace-nowrap">Already on your list</span>
+                      )}
                     </li>
                   ))}
                 </ul>
@@ -181,7 +226,9 @@ export default function BrainOffload() {
           <div className="flex gap-3">
             <button
               onClick={() => {
+                if (processing) return;
                 setOrganized(null);
+                setDuplicates({});
                 setInput("");
               }}
               data-testid="brain-offload-restart-btn"
@@ -191,8 +238,9 @@ export default function BrainOffload() {
             </button>
             <button
               onClick={saveTasks}
+              disabled={processing}
               data-testid="brain-offload-save-btn"
-              className="flex-1 bg-primary text-white hover:bg-primary/90 shadow-sm hover:shadow-md transition-all duration-300 py-4 rounded-full flex items-center justify-center gap-2"
+              className="flex-1 bg-primary text-white hover:bg-primary/90 shadow-sm hover:shadow-md transition-all duration-300 py-4 rounded-full flex items-center justify-center gap-2 disabled:opacity-50"
             >
               Save to My Tasks
               <ArrowRight strokeWidth={1.5} size={18} />
@@ -47,7 +47,7 @@ export default function Dashboard() {
 
   const fetchData = async () => {
     try {
-      const tasksRes = await axios.get(`${API}/tasks/${USER_ID}?category=today`);
+      const tasksRes = await axios.get(`${API}/tasks/${USER_ID}?category=today&fields=id,title,description,completed`);
       setTasks(tasksRes.data.filter((t) => !t.completed));
       
       // Fetch user's onboarding profile for personalization
@@ -60,7 +60,7 @@ export default function Dashboard() {
 
       // Fetch bills and routines data for live integration
       try {
-        const billsRes = await axios.get(`${API}/bills/${USER_ID}`);
+        const billsRes = await axios.get(`${API}/bills/${USER_ID}?fields=id,name,amount,due_date,paid`);
         setBills(billsRes.data);
       } catch (billsError) {
         console.log("Error fetching bills:", billsError);
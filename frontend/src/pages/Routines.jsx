@@ -2,6 +2,7 @@ import { useState, useEffect } from "react";
 import axios from "axios";
 import { Plus, CheckCircle2, Edit2, Trash2, X, Check } from "lucide-react";
 import { toast } from "sonner";
+import { useLiveChanges, applyChange } from "@/hooks/use-live-changes";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -22,6 +23,11 @@ export default function Routines() {
     fetchRoutines();
   }, []);
 
+  const applyRoutineChange = (event) => setRoutines((current) => applyChange(current, event));
+
+  // Changes from this tab, other tabs and other devices all arrive here
+  useLiveChanges(USER_ID, "routines", applyRoutineChange, () => fetchRoutines());
+
   const fetchRoutines = async () => {
     try {
       const res = await axios.get(`${API}/routines/${USER_ID}`);
@@ -39,7 +45,7 @@ export default function Routines() {
     if (!newRoutine.name.trim()) return;
 
     try {
-      await axios.post(`${API}/routines`, {
+      const res = await axios.post(`${API}/routines`, {
         user_id: USER_ID,
         name: newRoutine.name,
         time_of_day: newRoutine.time_of_day,
@@ -47,7 +53,7 @@ export default function Routines() {
       });
       setNewRoutine({ name: "", time_of_day: "morning", items: [""] });
       setShowAdd(false);
-      fetchRoutines();
+      applyRoutineChange({ op: "upsert", id: res.data.id, document: res.data });
       toast.success("Your ritual is set. A small anchor for your day.");
     } catch (error) {
       console.error("Error adding routine:", error);
@@ -58,7 +64,9 @@ export default function Routines() {
   const completeRoutine = async (routineId) => {
     try {
       await axios.patch(`${API}/routines/${routineId}/complete`);
-      fetchRoutines();
+      setRoutines((current) =>
+        current.map((routine) => (routine.id === routineId ? { ...routine, completed_today: true } : routine))
+      );
       toast.success("Done. One soft step forward.");
     } catch (error) {
       toast.error("That didn't go through. Let's try that again slowly.");
@@ -85,7 +93,7 @@ export default function Routines() {
     if (!newRoutine.name.trim()) return;
 
     try {
-      await axios.patch(`${API}/routines/${editingRoutine}`, {
+      const res = await axios.patch(`${API}/routines/${editingRoutine}`, {
         user_id: USER_ID,
         name: newRoutine.name,
         time_of_day: newRoutine.time_of_day,
@@ -93,7 +101,7 @@ export default function Routines() {
       });
       setNewRoutine({ name: "", time_of_day: "morning", items: [""] });
       setEditingRoutine(null);
-      fetchRoutines();
+      applyRoutineChange({ op: "upsert", id: res.data.id, document: res.data });
       toast.success("Your ritual is set. A small anchor for your day.");
     } catch (error) {
       console.error("Error updating routine:", error);
@@ -104,7 +112,7 @@ export default function Routines() {
   const deleteRoutine = async (routineId) => {
     try {
       await axios.delete(`${API}/routines/${routineId}`);
-      fetchRoutines();
+      applyRoutineChange({ op: "delete", id: routineId });
       toast.success("Stored away safely.");
     } catch (error) {
       toast.error("That didn't go through. Let's try that again slowly.");
@@ -1,33 +1,38 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import { Plus, Trash2, Edit2, MoveRight, X, Check } from "lucide-react";
 import { toast } from "sonner";
+import { useLiveChanges, applyChange } from "@/hooks/use-live-changes";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 const USER_ID = "demo-user-123";
 
 export default function Tasks() {
-  const [tasks, setTasks] = useState({ today: [], this_week: [], later: [] });
+  const [allTasks, setAllTasks] = useState([]);
   const [newTask, setNewTask] = useState({ title: "", category: "today" });
   const [loading, setLoading] = useState(true);
   const [editingTask, setEditingTask] = useState(null);
   const [editTitle, setEditTitle] = useState("");
   const [movingTask, setMovingTask] = useState(null);
+  // Operation time of our last write, so the refetch reads at least that fresh
+  const causalToken = useRef(null);
 
   useEffect(() => {
     fetchTasks();
   }, []);
 
+  const applyTaskChange = (event) => setAllTasks((current) => applyChange(current, event));
+
+  // Changes from this tab, other tabs and other devices all arrive here
+  useLiveChanges(USER_ID, "tasks", applyTaskChange, () => fetchTasks());
+
   const fetchTasks = async () => {
     try {
-      const res = await axios.get(`${API}/tasks/${USER_ID}`);
-      const grouped = {
-        today: res.data.filter((t) => t.category === "today" && !t.completed),
-        this_week: res.data.filter((t) => t.category === "this_week" && !t.completed),
-        later: res.data.filter((t) => t.category === "later" && !t.completed),
-      };
-      setTasks(grouped);
+      const res = await axios.get(`${API}/tasks/${USER_ID}`, {
+        headers: causalToken.current ? { "X-Causal-Token": causalToken.current } : {},
+      });
+      setAllTasks(res.data);
     } catch (error) {
       console.error("Error fetching tasks:", error);
       toast.error("We couldn't save this right now. Your information is safe — try again in a moment.");
@@ -36,6 +41,12 @@ export default function Tasks() {
     }
   };
 
+  // Apply our own writes right away instead of refetching the list
+  const rememberWrite = (res, event) => {
+    causalToken.current = res.headers["x-causal-token"] || causalToken.current;
+    applyTaskChange(event);
+  };
+
   const addTask = async (e) => {
     e.preventDefault();
     if (!newTask.title.trim()) {
@@ -44,13 +55,13 @@ export default function Tasks() {
     }
 
     try {
-      await axios.post(`${API}/tasks`, {
+      const res = await axios.post(`${API}/tasks`, {
         user_id: USER_ID,
         title: newTask.title,
         category: newTask.category,
       });
+      rememberWrite(res, { op: "upsert", id: res.data.id, document: res.data });
       setNewTask({ title: "", category: "today" });
-      fetchTasks();
       toast.success("Captured. One less thing to hold in your mind.");
     } catch (error) {
       console.error("Error adding task:", error);
@@ -60,8 +71,8 @@ export default function Tasks() {
 
   const completeTask = async (taskId) => {
     try {
-      await axios.patch(`${API}/tasks/${taskId}`, { completed: true });
-      fetchTasks();
+      const res = await axios.patch(`${API}/tasks/${taskId}`, { completed: true });
+      rememberWrite(res, { op: "upsert", id: taskId, document: res.data });
       toast.success("Done. One soft step forward.");
     } catch (error) {
       toast.error("That didn't go through. Let's try that again slowly.");
@@ -70,8 +81,8 @@ export default function Tasks() {
 
   const deleteTask = async (taskId) => {
     try {
-      await axios.delete(`${API}/tasks/${taskId}`);
-      fetchTasks();
+      const res = await axios.delete(`${API}/tasks/${taskId}`);
+      rememberWrite(res, { op: "delete", id: taskId });
       toast.success("Removed. You're in control of your space.");
     } catch (error) {
       toast.error("That didn't go through. Let's try that again slowly.");
@@ -92,10 +103,10 @@ export default function Tasks() {
     if (!editTitle.trim()) return;
 
     try {
-      await axios.patch(`${API}/tasks/${taskId}`, { title: editTitle });
+      const res = await axios.patch(`${API}/tasks/${taskId}`, { title: editTitle });
+      rememberWrite(res, { op: "upsert", id: taskId, document: res.data });
       setEditingTask(null);
       setEditTitle("");
-      fetchTasks();
       toast.success("Captured. One less thing to hold in your mind.");
     } catch (error) {
       toast.error("That didn't go through. Let's try that again slowly.");
@@ -104,15 +115,21 @@ export default function Tasks() {
 
   const moveTask = async (taskId, newCategory) => {
     try {
-      await axios.patch(`${API}/tasks/${taskId}`, { category: newCategory });
+      const res = await axios.patch(`${API}/tasks/${taskId}`, { category: newCategory });
+      rememberWrite(res, { op: "upsert", id: taskId, document: res.data });
       setMovingTask(null);
-      fetchTasks();
       toast.success("Moved gently to a new space.");
     } catch (error) {
       toast.error("Something didn't save properly. It's okay — let's try that again.");
     }
   };
 
+  const tasks = {
+    today: allTasks.filter((t) => t.category === "today" && !t.completed),
+    this_week: allTasks.filter((t) => t.category === "this_week" && !t.completed),
+    later: allTasks.filter((t) => t.category === "later" && !t.completed),
+  };
+
   if (loading) {
     return (
       <div className="flex items-center justify-center min-h-[60vh]">
@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import IncrementalJsonArray
+
+
+def feed_all(chunks):
+    parser = IncrementalJsonArray()
+    elements = []
+    for chunk in chunks:
+        elements.extend(parser.feed(chunk))
+    return parser, elements
+
+
+def test_elements_split_across_chunks():
+    text = '[{"title": "Call mom", "category": "today"}, {"title": "Taxes", "category": "later"}]'
+    for size in (1, 3, 7, len(text)):
+        _, elements = feed_all([text[i:i + size] for i in range(0, len(text), size)])
+        assert [e["title"] for e in elements] == ["Call mom", "Taxes"]
+
+
+def test_element_returned_as_soon_as_it_closes():
+    parser = IncrementalJsonArray()
+    assert parser.feed('[{"title": "a"}, {"tit') == [{"title": "a"}]
+    assert parser.feed('le": "b"}]') == [{"title": "b"}]
+
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    text = r'[{"title": "Say \"hi\" to {Sam} [soon]\\", "category": "today"}]'
+    _, elements = feed_all([text[i:i + 2] for i in range(0, len(text), 2)])
+    assert elements == [{"title": 'Say "hi" to {Sam} [soon]\\', "category": "today"}]
+
+
+def test_escape_split_at_chunk_boundary():
+    parser = IncrementalJsonArray()
+    assert parser.feed('[{"title": "a\\') == []
+    assert parser.feed('"b"}]') == [{"title": 'a"b'}]
+
+
+def test_skips_preamble_and_drops_malformed_elements():
+    parser, elements = feed_all([
+        "Here you go (see [notes]):\n",
+        '[{"title": "ok"}, {"title": nope}, {"title": "also ok"}]',
+    ])
+    assert [e["title"] for e in elements] == ["ok", "also ok"]
+    assert parser.dropped == 1
+
+
+REPLY = '[{"title": "Call mom", "category": "today"}, {"title": "Renew passport", "category": "later"}]'
+
+
+def litellm_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeLitellm:
+    """Streams REPLY in small pieces and records how far it got."""
+
+    def __init__(self):
+        self.sent = 0
+        self.calls = []
+
+    async def acompletion(self, **kwargs):
+        self.calls.append(kwargs)
+
+        async def stream():
+            yield litellm_chunk(None)  # role-only first chunk
+            for i in range(0, len(REPLY), 8):
+                self.sent = i + 8
+                yield litellm_chunk(REPLY[i:i + 8])
+
+        return stream()
+
+
+class FakeChat:
+    def __init__(self, **kwargs):
+        pass
+
+    def with_model(self, provider, model):
+        return self
+
+    async def send_message(self, message):
+        return REPLY
+
+
+async def collect_offload(fake_litellm):
+    seen = []
+    async for task in server.llm_stream_offload("u", "call mom, passport someday"):
+        seen.append((task.title, fake_litellm.sent if fake_litellm else None))
+    return seen
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    module = SimpleNamespace(LlmChat=FakeChat, UserMessage=lambda text: SimpleNamespace(text=text))
+
+    async def load():
+        return module
+
+    monkeypatch.setattr(server, "load_llm_module", load)
+
+
+def test_tasks_stream_before_reply_finishes(monkeypatch, fake_llm):
+    fake_litellm = FakeLitellm()
+    monkeypatch.setattr(server, "LLM_STREAM_API_KEY", "key")
+    monkeypatch.setattr(server, "_litellm_module", fake_litellm)
+
+    seen = asyncio.run(collect_offload(fake_litellm))
+
+    assert [title for title, _ in seen] == ["Call mom", "Renew passport"]
+    # The first task was yielded while the rest of the reply was still unsent
+    assert seen[0][1] < len(REPLY)
+    call = fake_litellm.calls[0]
+    assert call["stream"] is True
+    assert call["model"] == "openai/gpt-5.1"
+    assert call["messages"][0] == {"role": "system", "content": server.BRAIN_OFFLOAD_PROMPT}
+
+
+def test_buffered_reply_without_stream_key(monkeypatch, fake_llm):
+    monkeypatch.setattr(server, "LLM_STREAM_API_KEY", None)
+    seen = asyncio.run(collect_offload(None))
+    assert [title for title, _ in seen] == ["Call mom", "Renew passport"]
@@ -0,0 +1,38 @@
+import numpy as np
+
+from server import lttb_downsample
+
+
+def test_keeps_first_and_last_points():
+    x = np.arange(100, dtype=float)
+    y = np.sin(x / 5)
+    selected = lttb_downsample(x, y, 10)
+    assert len(selected) == 10
+    assert selected[0] == 0
+    assert selected[-1] == 99
+
+
+def test_indices_are_strictly_increasing():
+    x = np.arange(250, dtype=float)
+    y = np.random.default_rng(0).normal(size=250)
+    selected = lttb_downsample(x, y, 40)
+    assert np.all(np.diff(selected) > 0)
+
+
+def test_returns_every_point_when_threshold_not_below_length():
+    x = np.arange(5, dtype=float)
+    y = x * 2
+    assert list(lttb_downsample(x, y, 5)) == [0, 1, 2, 3, 4]
+    assert list(lttb_downsample(x, y, 50)) == [0, 1, 2, 3, 4]
+
+
+def test_returns_every_point_when_threshold_too_small():
+    x = np.arange(20, dtype=float)
+    assert len(lttb_downsample(x, x, 2)) == 20
+
+
+def test_keeps_spike():
+    x = np.arange(60, dtype=float)
+    y = np.zeros(60)
+    y[31] = 10.0
+    assert 31 in lttb_downsample(x, y, 8)
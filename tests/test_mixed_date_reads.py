@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+BASE = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def mixed_checkins():
+    # Even days already migrated to BSON dates, odd days still ISO strings,
+    # as migrate_dates.py leaves them partway through
+    docs = []
+    for day in range(40):
+        created_at = BASE + timedelta(days=day, microseconds=day * 1000)
+        docs.append({
+            "id": str(day),
+            "user_id": "u",
+            "energy_level": day % 5 + 1,
+            "created_at": created_at if day % 2 == 0 else created_at.isoformat(),
+        })
+    return docs
+
+
+@pytest.fixture
+def mixed_db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test_database"]
+    asyncio.run(database.energy_checkins.insert_many(mixed_checkins()))
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "read_db", database)
+    return database
+
+
+def test_latest_checkins_come_first_across_formats(mixed_db):
+    checkins = asyncio.run(server.get_energy_checkins("u"))
+    assert [c["id"] for c in checkins] == [str(day) for day in range(39, 9, -1)]
+    assert all(isinstance(c["created_at"], datetime) for c in checkins)
+
+
+def test_ascending_read_interleaves_formats(mixed_db):
+    docs = asyncio.run(server.find_chronological(
+        mixed_db.energy_checkins, {"user_id": "u"}, {"_id": 0}, "created_at", 1, 5
+    ))
+    assert [d["id"] for d in docs] == ["0", "1", "2", "3", "4"]
+
+
+def test_trend_points_are_in_time_order(mixed_db):
+    trend = asyncio.run(server.get_energy_trend("u", start=None, end=None, max_points=10))
+    times = [point.created_at for point in trend.points]
+    assert trend.total_checkins == 40
+    assert times == sorted(times)
+    assert times[0] == BASE
+    assert times[-1] == BASE + timedelta(days=39, microseconds=39000)
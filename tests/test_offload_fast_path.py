@@ -0,0 +1,42 @@
+import pytest
+
+from server import fast_sort_offload
+
+
+def sorted_titles(raw_text):
+    tasks = fast_sort_offload(raw_text)
+    return None if tasks is None else [(task.title, task.category) for task in tasks]
+
+
+@pytest.mark.parametrize("raw_text, expected", [
+    ("buy milk tomorrow", [("Buy milk", "this_week")]),
+    ("Later: sort garage", [("Sort garage", "later")]),
+    ("Today: groceries", [("Groceries", "today")]),
+    ("Today – call the bank", [("Call the bank", "today")]),
+    ("pay rent by friday.", [("Pay rent", "this_week")]),
+    ("email Sam and today", [("Email Sam", "today")]),
+])
+def test_strips_keyword_and_leftover_punctuation(raw_text, expected):
+    assert sorted_titles(raw_text) == expected
+
+
+def test_sorts_each_listed_item():
+    assert sorted_titles("- call mom today\n- fix bike someday\n- dentist on monday") == [
+        ("Call mom", "today"),
+        ("Fix bike", "later"),
+        ("Dentist", "this_week"),
+    ]
+
+
+@pytest.mark.parametrize("raw_text", [
+    "",
+    "call mom",                                   # no time keyword
+    "call mom today or maybe tomorrow",           # two categories
+    "should I call mom today?",                   # question
+    "I'm so tired today",                         # feeling, not a task
+    "Today:",                                     # nothing left once the keyword goes
+    "today and",
+    "a b c d e f g h i j k today",                # too long for the rules
+])
+def test_defers_to_llm_when_unsure(raw_text):
+    assert fast_sort_offload(raw_text) is None